@@ -6,6 +6,12 @@ from Functions import process_pdf_task, extract_summary, extract_topics_lda
 def main():
     parser = argparse.ArgumentParser(description="Test PDF processing task.")
     parser.add_argument("--pdf", required=True, help="Path to the PDF file")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes used to extract pages (default: CPU count)",
+    )
 
     args = parser.parse_args()
 
@@ -16,7 +22,7 @@ def main():
         return
 
     # Call the Celery task function directly (without Celery async execution)
-    result = process_pdf_task(pdf_path)
+    result = process_pdf_task(pdf_path, args.workers)
     text = result["text"]
     topics = extract_topics_lda(text)
     print(text)
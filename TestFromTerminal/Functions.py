@@ -1,24 +1,58 @@
 from pypdf import PdfReader
+import os
 import re
 import string
 import unicodedata
 import spacy
 from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import itertools
 
 nlp = spacy.load("it_core_news_sm")  # Scegli il modello giusto per la tua lingua
 
+# Sotto questa soglia di pagine l'estrazione resta seriale
+PARALLEL_MIN_PAGES = 40
 
-def process_pdf_task(pdf_path):
+
+def _extract_page_range(pdf_path, start, stop):
+    """Eseguita in un processo separato: estrae le pagine [start, stop)."""
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def extract_pages(pdf_path, workers=None):
+    """
+    Extracts the text of every page in order, splitting page ranges across a
+    process pool for large files.
+    """
+    reader = PdfReader(pdf_path)
+    num_pages = len(reader.pages)
+    workers = min(workers or os.cpu_count() or 1, num_pages)
+
+    if workers <= 1 or num_pages < PARALLEL_MIN_PAGES:
+        return [page.extract_text() or "" for page in reader.pages]
+
+    size, remainder = divmod(num_pages, workers)
+    starts, stops = [], []
+    start = 0
+    for i in range(workers):
+        stop = start + size + (1 if i < remainder else 0)
+        starts.append(start)
+        stops.append(stop)
+        start = stop
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = pool.map(_extract_page_range, repeat(pdf_path), starts, stops)
+        return [text for chunk in chunks for text in chunk]
+
+
+def process_pdf_task(pdf_path, workers=None):
     """
     Extracts text from a PDF using pypdf, returns the extracted text as a string.
     """
     try:
-        reader = PdfReader(pdf_path)
-        pages_text = []
-        for page in reader.pages:
-            text = page.extract_text() or ""
-            pages_text.append(text)
+        pages_text = extract_pages(pdf_path, workers)
 
         # Combine all pages into one big string (or handle as you like)
         full_text = "\n".join(pages_text)
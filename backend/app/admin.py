@@ -16,6 +16,7 @@ from .models import (
     ImportantDate,
     Timeline,
     MentionedPerson,
+    ProcessedContent,
 )
 
 admin.site.register(CustomUser)
@@ -34,4 +35,5 @@ admin.site.register(Task)
 admin.site.register(ImportantDate)
 admin.site.register(Timeline)
 admin.site.register(MentionedPerson)
+admin.site.register(ProcessedContent)
 admin.site.site_header = "AI Tutor Admin"
\ No newline at end of file
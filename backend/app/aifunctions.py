@@ -1,11 +1,28 @@
 from decouple import config
+from django.conf import settings
 import google.generativeai as genai
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    GatewayTimeout,
+    InternalServerError,
+    ResourceExhausted,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+import json
 import logging
+import math
+import os
+import random
+import threading
+import time
+
+from . import llm_cache, metering, rate_limit
 
 logger = logging.getLogger(__name__)
 
-# Configure Google API
-genai.configure(api_key=config("GEMINI_API_KEY"))
+# Default Gemini model
+MODEL_NAME = "models/gemini-2.0-flash-lite"
 
 # Default generation config
 GENERATION_CONFIG = {
@@ -16,38 +33,225 @@ GENERATION_CONFIG = {
     "response_mime_type": "text/plain",
 }
 
-def generate_response_from_google(prompt):
+# Average characters per token of the Gemini tokenizer, for local estimates
+CHARS_PER_TOKEN = 4
+
+# API errors worth retrying later: overload, quota and timeouts
+TRANSIENT_API_ERRORS = (
+    ResourceExhausted,
+    TooManyRequests,
+    ServiceUnavailable,
+    DeadlineExceeded,
+    GatewayTimeout,
+    InternalServerError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class GeminiError(Exception):
+    """A Gemini call failed."""
+
+
+class GeminiTransientError(GeminiError):
+    """A Gemini call failed in a way that is worth retrying (quota, timeout, overload)."""
+
+
+class _CallbackError(Exception):
+    """Wraps an error of the `on_text` callback, so that it is not taken for an API error."""
+
+
+# Process-wide clients: {"pid": int, "models": {(model_name, config): GenerativeModel}}.
+# The underlying gRPC channel must not be shared across fork(), hence the pid.
+_clients = {"pid": None, "models": {}}
+_lock = threading.Lock()
+
+
+def get_model(model_name=MODEL_NAME, generation_config=None):
+    """
+    Returns a long-lived GenerativeModel for the given model and config,
+    configuring the API key on first use. Models (and their connection) are
+    reused by every call of the process instead of being built per request.
+    """
+    generation_config = generation_config or GENERATION_CONFIG
+    # The config may hold nested values (e.g. a response schema): key on its JSON
+    key = (model_name, json.dumps(generation_config, sort_keys=True))
+
+    models = _clients["models"]
+    if _clients["pid"] != os.getpid() or key not in models:
+        with _lock:
+            if _clients["pid"] != os.getpid():
+                # First call in this process (or in a freshly forked child)
+                genai.configure(api_key=config("GEMINI_API_KEY"))
+                _clients["pid"] = os.getpid()
+                _clients["models"] = {}
+            models = _clients["models"]
+            if key not in models:
+                models[key] = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                )
+    return models[key]
+
+
+def estimate_tokens(text):
+    """Estimates the number of tokens of a text locally, without calling the API."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def generate_response_from_google(
+    prompt,
+    model_name=MODEL_NAME,
+    generation_config=None,
+    use_cache=True,
+    on_text=None,
+    raise_on_error=False,
+    usage_user_id=None,
+):
     """
     Calls Google Gemini API with the given prompt and returns the response text along with token usage.
+    Token counts come from the response `usage_metadata`, or are estimated locally when missing.
+    Identical calls are answered from the LLM cache (no tokens used) unless `use_cache` is False.
+
+    With `on_text`, the response is streamed: each text fragment is passed to
+    `on_text` as soon as it arrives and is not kept, so the returned "text" is
+    None and "streamed" is True. Streamed calls bypass the cache.
+
+    Failed calls return a response with "text": None and the "error", or with
+    `raise_on_error` raise GeminiTransientError (worth retrying) or GeminiError.
+    The tokens of the call are metered to `usage_user_id` (see app.metering).
     """
-    try:
-        model = genai.GenerativeModel(
-            model_name="models/gemini-2.0-flash-lite",
-            generation_config=GENERATION_CONFIG,
-        )
+    generation_config = generation_config or GENERATION_CONFIG
+    streaming = on_text is not None
+    cache_key = None
+    if use_cache and not streaming and settings.LLM_CACHE_ENABLED:
+        cache_key = llm_cache.make_key(model_name, generation_config, prompt)
+        cached = llm_cache.lookup(cache_key)
+        if cached is not None:
+            logger.info("Gemini response served from the LLM cache")
+            return {"text": cached["text"], "input_tokens": 0, "output_tokens": 0, "cached": True}
+
+    # Reserve the prompt plus a typical answer; corrected once the usage is known
+    estimated_tokens = estimate_tokens(prompt) + settings.GEMINI_OUTPUT_TOKENS_ESTIMATE
+    streamed_chars = 0
+
+    def stream(fragment):
+        nonlocal streamed_chars
+        streamed_chars += len(fragment)
+        try:
+            on_text(fragment)
+        except Exception as e:
+            raise _CallbackError() from e
+
+    def meter_partial_stream():
+        # A stream that failed midway was still generated (and billed) up to there
+        if streamed_chars:
+            metering.record_usage(
+                usage_user_id,
+                "gemini",
+                input_tokens=estimate_tokens(prompt),
+                output_tokens=math.ceil(streamed_chars / CHARS_PER_TOKEN),
+            )
+
+    for attempt in range(1, settings.GEMINI_THROTTLE_ATTEMPTS + 1):
+        try:
+            # TooManyRequests: any HTTP 429, ResourceExhausted (gRPC) included
+            with rate_limit.acquire(
+                model_name, estimated_tokens, throttle_errors=TooManyRequests
+            ) as reservation:
+                model = get_model(model_name, generation_config)
+                text, usage_metadata = _generate(model, prompt, stream if streaming else None)
 
-        # ✅ First, count input tokens before making the request
-        token_info = model.count_tokens(prompt)
-        input_tokens = token_info.total_tokens if token_info else None
+                # ✅ Extract token usage properly from `usage_metadata`
+                prompt_tokens = usage_metadata.prompt_token_count if usage_metadata else None
+                response_tokens = usage_metadata.candidates_token_count if usage_metadata else None
+                if prompt_tokens is None:
+                    prompt_tokens = estimate_tokens(prompt)
+                if response_tokens is None:
+                    response_tokens = (
+                        math.ceil(streamed_chars / CHARS_PER_TOKEN)
+                        if streaming
+                        else estimate_tokens(text)
+                    )
+                reservation.record_usage(prompt_tokens + response_tokens)
+            break
 
-        # Send user input to the model
+        except TooManyRequests as e:
+            # The limiter has already reduced the concurrency: try again after a
+            # backoff, unless part of a streamed response has already been consumed
+            if attempt == settings.GEMINI_THROTTLE_ATTEMPTS or streamed_chars:
+                logger.error(f"Google Gemini API quota exceeded: {e}")
+                meter_partial_stream()
+                return _failure("rate_limited", True, raise_on_error)
+            backoff = settings.GEMINI_THROTTLE_COOLDOWN * 2 ** (attempt - 1)
+            logger.warning(
+                f"Google Gemini API quota exceeded, attempt {attempt}, retrying in ~{backoff}s: {e}"
+            )
+            # Jitter, so that the calls throttled together do not come back together
+            time.sleep(backoff * random.uniform(0.5, 1))
+        except _CallbackError as e:
+            meter_partial_stream()
+            raise e.__cause__  # Not an API error: e.g. saving a streamed item failed
+        except rate_limit.RateLimitTimeout as e:
+            logger.error(f"Google Gemini API call not sent: {e}")
+            return _failure("rate_limited", True, raise_on_error)
+        except Exception as e:
+            logger.error(f"Error calling Google Gemini API: {e}")
+            meter_partial_stream()
+            return _failure(str(e), isinstance(e, TRANSIENT_API_ERRORS), raise_on_error)
+
+    logger.info(f"Token Usage - Prompt: {prompt_tokens}, Response: {response_tokens}")
+    metering.record_usage(
+        usage_user_id, "gemini", input_tokens=prompt_tokens, output_tokens=response_tokens
+    )
+
+    # Only successful responses are cached
+    if cache_key and text:
+        llm_cache.store(cache_key, {"text": text})
+
+    return {
+        "text": text,
+        "input_tokens": prompt_tokens,
+        "output_tokens": response_tokens,
+        "cached": False,
+        "streamed": streaming,
+    }
+
+
+def _generate(model, prompt, on_text=None):
+    """Sends the prompt and returns (text, usage_metadata); streamed text goes to `on_text` only."""
+    if on_text is None:
         response = model.generate_content(prompt)
+        text = response.text if response.text else None
+    else:
+        text = None
+        response = model.generate_content(prompt, stream=True)
+        for chunk in response:
+            fragment = _chunk_text(chunk)
+            if fragment:
+                on_text(fragment)
+    return text, getattr(response, "usage_metadata", None)
+
 
-        # ✅ Extract token usage properly from `usage_metadata`
-        usage_metadata = getattr(response, "usage_metadata", None)
-        
-        prompt_tokens = usage_metadata.prompt_token_count if usage_metadata else None
-        response_tokens = usage_metadata.candidates_token_count if usage_metadata else None
-        total_tokens = usage_metadata.total_token_count if usage_metadata else None
+def _failure(error, transient, raise_on_error):
+    if raise_on_error:
+        raise (GeminiTransientError if transient else GeminiError)(error)
+    return _error_response(error)
 
-        logger.info(f"Token Usage - Prompt: {prompt_tokens}, Response: {response_tokens}, Total: {total_tokens}")
 
-        return {
-            "text": response.text if response.text else None,
-            "input_tokens": prompt_tokens,
-            "output_tokens": response_tokens,
-        }
+def _error_response(error):
+    return {
+        "text": None,
+        "input_tokens": None,
+        "output_tokens": None,
+        "total_tokens": None,
+        "error": error,
+    }
 
-    except Exception as e:
-        logger.error(f"Error calling Google Gemini API: {e}")
-        return {"text": None, "input_tokens": None, "output_tokens": None, "total_tokens": None}
\ No newline at end of file
+
+def _chunk_text(chunk):
+    # `.text` raises on chunks without text parts (e.g. the final one)
+    try:
+        return chunk.text
+    except ValueError:
+        return None
@@ -0,0 +1,617 @@
+import json
+import logging
+import math
+import re
+
+from . import metrics
+from .aifunctions import GENERATION_CONFIG
+from .models import KeyConcepts, MentionedPerson, Summary, Table, Timeline
+
+logger = logging.getLogger(__name__)
+
+
+# Artifacts generated for a lesson, each by its own focused prompt
+ARTIFACTS = ("summary", "key_concepts", "tables", "timeline", "people")
+
+# Artifacts streamed from Gemini and saved item by item as they arrive
+STREAMED_ARTIFACTS = ("summary", "key_concepts")
+
+# Per artifact: (instructions, example of the expected JSON)
+ARTIFACT_PROMPTS = {
+    "summary": (
+        "Genera un riassunto dettagliato del seguente testo suddiviso in molti paragrafi. "
+        "Ogni paragrafo deve avere:\n"
+        "- Un ID numerico progressivo\n"
+        "- Un titolo breve e descrittivo\n"
+        "- Un riassunto dettagliato e completo per studiare",
+        "{\n"
+        '  "summary": [\n'
+        "    {\n"
+        '      "id": 1,\n'
+        '      "title": "Titolo del paragrafo",\n'
+        '      "summary": "Riassunto del paragrafo"\n'
+        "    }\n"
+        "  ]\n"
+        "}",
+    ),
+    "key_concepts": (
+        "Identifica circa {key_concepts_count} concetti chiave del seguente testo. "
+        "Per ogni concetto, fornisci:\n"
+        "- Un titolo breve e descrittivo\n"
+        "- Una descrizione dettagliata\n"
+        "- Un livello di importanza da 1 a 5\n"
+        "- Sinonimi rilevanti\n"
+        "- Errori comuni o idee sbagliate associate al concetto",
+        "{\n"
+        '  "key_concepts": [\n'
+        "    {\n"
+        '      "id": 1,\n'
+        '      "title": "Titolo del concetto",\n'
+        '      "description": "Descrizione del concetto",\n'
+        '      "importance": 5,\n'
+        '      "synonyms": ["Sinonimo 1", "Sinonimo 2"],\n'
+        '      "misconceptions": ["Errore comune 1", "Errore comune 2"]\n'
+        "    }\n"
+        "  ]\n"
+        "}",
+    ),
+    "tables": (
+        "Genera varie tabelle (se riesci) in formato JSON a partire dal seguente testo. "
+        "Ogni tabella deve avere:\n"
+        "- Un titolo breve\n"
+        "- Dati della tabella in formato JSON (array di oggetti con colonne come 'id', 'prodotto', 'prezzo', ecc.)",
+        "{\n"
+        '  "tables": [\n'
+        "    {\n"
+        '      "title": "Tabella Prodotti",\n'
+        '      "data": [\n'
+        "        {\"id\": 201, \"prezzo\": 1200, \"prodotto\": \"Laptop\", \"disponibile\": \"Sì\"},\n"
+        "        {\"id\": 202, \"prezzo\": 800, \"prodotto\": \"Smartphone\", \"disponibile\": \"No\"}\n"
+        "      ]\n"
+        "    }\n"
+        "  ]\n"
+        "}",
+    ),
+    "timeline": (
+        "Fornisci un elenco delle principali tappe temporali (timeline) nel seguente testo. "
+        "Ogni evento nella timeline deve avere:\n"
+        "- Un titolo descrittivo dell'evento\n"
+        "- Una descrizione completa dell'evento\n"
+        "- Una data o periodo in formato numerico o stringa",
+        "{\n"
+        '  "timeline": [\n'
+        "    {\n"
+        '      "title": "Battaglia di Azios",\n'
+        '      "description": "Ottaviano sconfigge Marco Antonio, fine delle guerre civili",\n'
+        '      "date": "32 a.C."\n'
+        "    }\n"
+        "  ]\n"
+        "}",
+    ),
+    "people": (
+        "Identifica le persone più importanti menzionate nel seguente testo. "
+        "Per ciascuna persona fornisci:\n"
+        "- Il nome completo\n"
+        "- Una biografia",
+        "{\n"
+        '  "people": [\n'
+        "    {\n"
+        '      "name": "Giulio Cesare",\n'
+        '      "bio": "Generale e politico romano, fu uno dei protagonisti della fine della Repubblica e l’inizio dell’Impero."\n'
+        "    }\n"
+        "  ]\n"
+        "}",
+    ),
+}
+
+
+def _array_of(properties, required):
+    return {
+        "type": "ARRAY",
+        "items": {"type": "OBJECT", "properties": properties, "required": required},
+    }
+
+
+_STRING = {"type": "STRING"}
+_STRINGS = {"type": "ARRAY", "items": _STRING}
+
+# Response schemas for Gemini structured output. Tables have free-form rows,
+# which a schema cannot describe: they only get the JSON mime type.
+ARTIFACT_SCHEMAS = {
+    "summary": _array_of(
+        {"id": {"type": "INTEGER"}, "title": _STRING, "summary": _STRING},
+        ["id", "title", "summary"],
+    ),
+    "key_concepts": _array_of(
+        {
+            "id": {"type": "INTEGER"},
+            "title": _STRING,
+            "description": _STRING,
+            "importance": {"type": "INTEGER"},
+            "synonyms": _STRINGS,
+            "misconceptions": _STRINGS,
+        },
+        ["id", "title", "description", "importance"],
+    ),
+    "timeline": _array_of(
+        {"title": _STRING, "description": _STRING, "date": _STRING},
+        ["title", "description", "date"],
+    ),
+    "people": _array_of({"name": _STRING, "bio": _STRING}, ["name", "bio"]),
+}
+
+
+def artifact_generation_config(artifact):
+    """Gemini generation config asking for JSON output, validated against the artifact schema."""
+    generation_config = {**GENERATION_CONFIG, "response_mime_type": "application/json"}
+    if artifact in ARTIFACT_SCHEMAS:
+        generation_config["response_schema"] = {
+            "type": "OBJECT",
+            "properties": {artifact: ARTIFACT_SCHEMAS[artifact]},
+            "required": [artifact],
+        }
+    return generation_config
+
+
+def build_artifact_prompt(artifact, text, key_concepts_count=None):
+    """Focused prompt asking Gemini for a single artifact (summary, key concepts, ...) of a text."""
+    instructions, example = ARTIFACT_PROMPTS[artifact]
+    return (
+        f"{instructions.format(key_concepts_count=key_concepts_count)}\n\n"
+        "Restituisci la risposta in formato JSON con la seguente struttura:\n"
+        f"{example}\n\n"
+        f"Testo:\n{text}"
+    )
+
+
+def chunk_key_concepts_count(key_concepts_count, num_chunks):
+    """Key concepts asked for each chunk: a share of the total, reduced again after merging."""
+    if not key_concepts_count or num_chunks == 1:
+        return key_concepts_count
+    return max(2, math.ceil(int(key_concepts_count) / num_chunks) + 1)
+
+
+def clean_json_response(text):
+    """
+    Extracts JSON from a Markdown code block (```json ... ```), also when the
+    closing fence is missing (truncated response). Only a fence that opens the
+    response is stripped: backticks inside the JSON strings are kept.
+    If no Markdown code block is found, returns the original text.
+    """
+    text = text.strip()
+    if not text.startswith("```"):
+        return text  # Fallback: return the original text if no Markdown is found
+
+    body = re.sub(r"^```[\w-]*[ \t]*\n?", "", text, count=1)  # Fence and language tag
+    # The closing fence is the last one, on its own line or right after the JSON
+    end = body.rfind("\n```")
+    if end >= 0:
+        body = body[:end]
+    elif body.endswith("```"):
+        body = body[:-3]
+    return body.strip()
+
+
+def parse_analysis_response(text):
+    """
+    Parses the JSON analysis returned by Gemini (optionally inside a Markdown
+    code block). Malformed JSON is repaired with `repair_json` before giving up,
+    which is much cheaper than generating the response again.
+    """
+    cleaned = clean_json_response(text)
+    try:
+        return json.loads(cleaned, strict=False)
+    except json.JSONDecodeError as e:
+        logger.warning(f"🩹 Repairing malformed JSON response: {e}")
+        metrics.incr(metrics.JSON_REPAIRS)
+        return json.loads(repair_json(cleaned), strict=False)
+
+
+# Characters that can make up a number or a true/false/null literal
+_LITERAL_CHARS = frozenset("-+.0123456789eEtrufalsn")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def repair_json(text):
+    """
+    Fixes the most common defects of LLM-generated JSON:
+    - missing commas between values (e.g. `] "people": [` after an array)
+    - trailing commas before `}` or `]`
+    - raw newlines inside strings
+    - truncated output: unterminated strings, dangling keys and unclosed brackets
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=0)
+    out = []
+    stack = []
+    in_string = escape = string_is_key = False
+    prev = ""  # Last significant character outside strings
+    gap = False  # Whitespace since `prev`
+    last_comma = None  # Position in `out` of a comma not yet followed by a value
+
+    for char in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                prev = '"'
+            elif char == "\n":
+                char = "\\n"
+            out.append(char)
+            continue
+
+        if char.isspace():
+            out.append(char)
+            gap = True
+            continue
+
+        starts_value = char in '"{[' or (
+            char in _LITERAL_CHARS and (gap or prev not in _LITERAL_CHARS)
+        )
+        gap = False
+        ends_value = bool(prev) and (prev in '"}]' or prev in _LITERAL_CHARS)
+        if starts_value and ends_value:
+            out.append(",")
+            prev = ","
+
+        if char == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and prev in "{,"
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if prev == "," and last_comma is not None:
+                del out[last_comma]  # Trailing comma
+            if stack:
+                char = _CLOSERS[stack.pop()]
+            else:
+                continue  # Unbalanced closer
+        elif char == ",":
+            if prev in ",{[":
+                continue  # Repeated or leading comma
+            last_comma = len(out)
+
+        if char != ",":
+            last_comma = None
+        out.append(char)
+        if not in_string:
+            prev = char
+
+    # Truncated output: close what was left open
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+        prev = '"'
+    text = "".join(out).rstrip()
+    if prev == ",":
+        text = text[: text.rfind(",")]
+    elif prev == ":" or (prev == '"' and string_is_key):
+        text += ("" if prev == ":" else ":") + "null"
+    return text + "".join(_CLOSERS[opener] for opener in reversed(stack))
+
+
+class StreamingArrayParser:
+    """
+    Incremental parser for a streamed JSON response shaped like
+    `{"key": [{...}, {...}], ...}`: `feed()` returns every (key, object) pair
+    whose object has been completely received, in order. Only the text of the
+    object being received is buffered; anything before the opening brace (e.g.
+    a Markdown code fence) is ignored.
+    """
+
+    def __init__(self):
+        self._stack = []  # Open containers: "{" or "["
+        self._in_string = False
+        self._escape = False
+        self._key = None  # Last string read directly inside the top-level object
+        self._key_chars = None
+        self._array_key = None  # Key of the top-level array being read
+        self._buffer = []  # Text of the object being received
+
+    def feed(self, text):
+        items = []
+        start = 0 if self._buffer else None
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._key = "".join(self._key_chars)
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if len(self._stack) == 1:
+                    self._key_chars = []
+            elif char in "{[":
+                if char == "[" and len(self._stack) == 1:
+                    self._array_key = self._key
+                elif char == "{" and len(self._stack) == 2 and self._stack[-1] == "[":
+                    start = i  # An element of a top-level array begins
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and start is not None and len(self._stack) == 2:
+                    self._buffer.append(text[start : i + 1])
+                    item = _loads_item("".join(self._buffer))
+                    if item is not None:
+                        items.append((self._array_key, item))
+                    self._buffer = []
+                    start = None
+
+        if start is not None:
+            self._buffer.append(text[start:])
+        return items
+
+
+def _loads_item(text):
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        pass
+    metrics.incr(metrics.JSON_REPAIRS)
+    try:
+        return json.loads(repair_json(text), strict=False)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Skipping a malformed streamed item: {e}")
+        return None
+
+
+### --- REDUCE --- ###
+
+
+def _normalize(value):
+    return " ".join(str(value or "").split()).casefold()
+
+
+def _longest(a, b):
+    return b if len(str(b or "")) > len(str(a or "")) else a
+
+
+def _union(a, b):
+    merged = list(a or [])
+    seen = {_normalize(item) for item in merged}
+    for item in b or []:
+        if _normalize(item) not in seen:
+            seen.add(_normalize(item))
+            merged.append(item)
+    return merged
+
+
+def merge_summaries(summaries):
+    """Concatenates the summary paragraphs of the chunks, in order, renumbering their ids."""
+    merged = []
+    for paragraphs in summaries:
+        if not isinstance(paragraphs, list):
+            continue
+        for paragraph in paragraphs:
+            merged.append({**paragraph, "id": len(merged) + 1})
+    return merged
+
+
+def merge_key_concepts(concept_lists, key_concepts_count=None):
+    """
+    Merges the key concepts of the chunks by title: duplicates keep the
+    longest description, the highest importance and the union of synonyms
+    and misconceptions. Returns the `key_concepts_count` most important ones.
+    """
+    merged = {}
+    for concepts in concept_lists:
+        for concept in concepts:
+            key = _normalize(concept.get("title"))
+            if not key:
+                continue
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = dict(concept)
+                continue
+            existing["description"] = _longest(
+                existing.get("description"), concept.get("description")
+            )
+            existing["importance"] = max(
+                _importance(existing), _importance(concept)
+            )
+            existing["synonyms"] = _union(existing.get("synonyms"), concept.get("synonyms"))
+            existing["misconceptions"] = _union(
+                existing.get("misconceptions"), concept.get("misconceptions")
+            )
+
+    # Stable sort: equally important concepts keep the order of the text
+    concepts = sorted(merged.values(), key=_importance, reverse=True)
+    if key_concepts_count:
+        concepts = concepts[: int(key_concepts_count)]
+    return [{**concept, "id": i} for i, concept in enumerate(concepts, start=1)]
+
+
+def _importance(concept):
+    try:
+        return int(concept.get("importance") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def merge_tables(table_lists):
+    """Merges the tables of the chunks by title, appending the rows not already present."""
+    merged = {}
+    for tables in table_lists:
+        for table in tables:
+            key = _normalize(table.get("title"))
+            existing = merged.setdefault(key, {**table, "data": []})
+            for row in table.get("data", []):
+                if row not in existing["data"]:
+                    existing["data"].append(row)
+    return list(merged.values())
+
+
+def merge_timelines(timelines):
+    """Merges the timeline events of the chunks, deduplicated by title and date."""
+    merged = {}
+    for events in timelines:
+        for event in events:
+            key = (_normalize(event.get("title")), _normalize(event.get("date")))
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = dict(event)
+            else:
+                existing["description"] = _longest(
+                    existing.get("description"), event.get("description")
+                )
+    return list(merged.values())
+
+
+def merge_people(people_lists):
+    """Merges the people of the chunks by name, keeping the longest biography."""
+    merged = {}
+    for people in people_lists:
+        for person in people:
+            key = _normalize(person.get("name"))
+            if not key:
+                continue
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = dict(person)
+            else:
+                existing["bio"] = _longest(existing.get("bio"), person.get("bio"))
+    return list(merged.values())
+
+
+def merge_artifact(artifact, chunk_items, key_concepts_count=None):
+    """Reduce step: merges the items of one artifact generated for each chunk (in chunk order)."""
+    if artifact == "key_concepts":
+        return merge_key_concepts(chunk_items, key_concepts_count)
+    return MERGERS[artifact](chunk_items)
+
+
+MERGERS = {
+    "summary": merge_summaries,
+    "tables": merge_tables,
+    "timeline": merge_timelines,
+    "people": merge_people,
+}
+
+
+### --- PERSIST --- ###
+
+
+# Model holding each artifact of a lesson
+ARTIFACT_MODELS = {
+    "summary": Summary,
+    "key_concepts": KeyConcepts,
+    "tables": Table,
+    "timeline": Timeline,
+    "people": MentionedPerson,
+}
+
+
+def clear_artifact(lesson, artifact):
+    """Deletes what a previous (failed or repeated) generation saved for this artifact."""
+    ARTIFACT_MODELS[artifact].objects.filter(lesson=lesson).delete()
+
+
+def persist_artifact(lesson, artifact, items, user):
+    """
+    Saves the generated items of one artifact of a lesson, replacing any
+    previous ones: saving the same artifact twice (e.g. on a retry) never
+    duplicates rows.
+    """
+    if artifact in ("key_concepts", "tables", "people"):
+        clear_artifact(lesson, artifact)
+
+    if artifact == "summary":
+        Summary.objects.update_or_create(
+            lesson=lesson,
+            defaults={
+                "user": user,
+                "title": f"Summary for Lesson {lesson.id}",
+                "content": items,  # Store the generated summary
+            },
+        )
+    elif artifact == "timeline":
+        Timeline.objects.update_or_create(
+            lesson=lesson,
+            defaults={
+                "user": user,
+                "title": f" Timeline for Lesson {lesson.id}",
+                "data": items,
+            },
+        )
+    elif artifact == "key_concepts":
+        for concept_data in items:
+            KeyConcepts.objects.create(
+                user=user,
+                lesson=lesson,
+                data=concept_data,
+            )
+    elif artifact == "tables":
+        for table_data in items:
+            Table.objects.create(
+                user=user,
+                title=table_data.get("title", "Untitled Table"),  # Handle cases where title might be missing
+                data=table_data.get("data", []),  # Default to empty list if no data is provided
+                lesson=lesson,
+            )
+    elif artifact == "people":
+        # Images are looked up by `fetch_people_images` before the transaction:
+        # bulk_create skips MentionedPerson.save() and its Wikipedia requests
+        MentionedPerson.objects.bulk_create(
+            [
+                MentionedPerson(
+                    user=user,
+                    lesson=lesson,
+                    name=person_data["name"],
+                    bio=person_data.get("bio"),
+                    image_url=person_data.get("image_url"),
+                )
+                for person_data in items
+                if person_data.get("name")
+            ]
+        )
+
+
+def fetch_people_images(items):
+    """
+    Adds the Wikipedia "image_url" of every generated person. These are HTTP
+    requests (up to two per person): call it outside any transaction.
+    """
+    for person_data in items:
+        if person_data.get("name") and not person_data.get("image_url"):
+            person_data["image_url"] = MentionedPerson(
+                name=person_data["name"]
+            ).fetch_wikipedia_image()
+    return items
+
+
+def persist_artifact_item(lesson, artifact, item, user):
+    """
+    Saves one streamed item of an artifact as soon as it has been parsed:
+    a summary paragraph is appended to the lesson Summary, a key concept is
+    saved as a new KeyConcepts row.
+    """
+    if artifact == "summary":
+        summary, _ = Summary.objects.get_or_create(
+            lesson=lesson,
+            defaults={
+                "user": user,
+                "title": f"Summary for Lesson {lesson.id}",
+                "content": [],
+            },
+        )
+        if not isinstance(summary.content, list):
+            summary.content = []
+        summary.content.append({**item, "id": len(summary.content) + 1})
+        summary.save(update_fields=["content", "updated_at"])
+    elif artifact == "key_concepts":
+        KeyConcepts.objects.create(user=user, lesson=lesson, data=item)
+    else:
+        raise ValueError(f"{artifact} items cannot be saved one by one")
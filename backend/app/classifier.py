@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Subjects a resource can be classified as (also listed in the Gemini prompt)
+SUBJECTS = [
+    "Storia",
+    "Scienza",
+    "Matematica",
+    "Filosofia",
+    "Letteratura",
+    "Geografia",
+    "Arte",
+    "Economia",
+    "Informatica",
+    "Altro",
+]
+
+# Who assigned LessonResource.subject, stored in metadata["subject_source"]
+SOURCE_CLASSIFIER = "classifier"
+SOURCE_LLM = "llm"
+
+MODEL_FILENAME = "subject_classifier.npz"
+
+# Words inside an LDA topic string: '0.050*"impero" + 0.031*"roma"'
+TOPIC_WORD_RE = re.compile(r'"([^"]+)"')
+
+# Process-wide cache of the loaded model
+_loaded = {"mtime": None, "model": None}
+
+
+def metadata_features(persons, locations, topics):
+    """
+    Turns the extracted metadata into classifier features. `persons` and
+    `locations` are (name, count) pairs, `topics` LDA topic strings or keywords.
+    """
+    features = [f"p:{name.lower()}" for name, _ in persons]
+    features += [f"l:{name.lower()}" for name, _ in locations]
+    for topic in topics:
+        words = TOPIC_WORD_RE.findall(topic) or [topic]
+        features += [f"t:{word.lower()}" for word in words]
+    return features
+
+
+def train_subject_classifier():
+    """
+    Trains a multinomial Naive Bayes classifier on the subjects assigned by
+    Gemini to the stored LessonResources, using their metadata as features.
+    Resources labelled by the classifier itself are left out, so it never
+    learns from its own guesses. Returns the model path, or None when there
+    are too few labelled resources.
+    """
+    from .models import LessonResource
+
+    resources = (
+        LessonResource.objects.filter(subject__in=SUBJECTS)
+        .exclude(metadata__subject_source=SOURCE_CLASSIFIER)
+        .values_list("subject", "metadata")
+        .iterator(chunk_size=500)
+    )
+    documents, labels = [], []
+    for subject, metadata in resources:
+        features = metadata_features(
+            metadata.get("persons", []),
+            metadata.get("locations", []),
+            metadata.get("topics", []),
+        )
+        if features:
+            documents.append(features)
+            labels.append(subject)
+
+    if len(documents) < settings.SUBJECT_CLASSIFIER_MIN_DOCUMENTS:
+        logger.info(
+            f"🏷️ Subject classifier not trained: {len(documents)} labelled resources "
+            f"(minimum {settings.SUBJECT_CLASSIFIER_MIN_DOCUMENTS})"
+        )
+        return None
+
+    classes = sorted(set(labels))
+    class_index = {subject: i for i, subject in enumerate(classes)}
+    vocabulary = {}
+    counts = {}
+    for features, subject in zip(documents, labels):
+        row = class_index[subject]
+        for feature in features:
+            column = vocabulary.setdefault(feature, len(vocabulary))
+            counts[row, column] = counts.get((row, column), 0) + 1
+
+    feature_counts = np.zeros((len(classes), len(vocabulary)))
+    for (row, column), count in counts.items():
+        feature_counts[row, column] = count
+
+    # Laplace smoothing
+    smoothed = feature_counts + 1.0
+    log_likelihood = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+    class_counts = np.bincount([class_index[s] for s in labels], minlength=len(classes))
+    log_prior = np.log(class_counts / class_counts.sum())
+
+    # Write to a temporary file and swap it in, so that workers never load a
+    # half-written model
+    os.makedirs(settings.NLP_MODEL_DIR, exist_ok=True)
+    model_path = os.path.join(settings.NLP_MODEL_DIR, MODEL_FILENAME)
+    tmp_model_path = f"{model_path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_model_path,
+        classes=np.array(classes),
+        vocabulary=np.array(list(vocabulary)),
+        log_prior=log_prior,
+        log_likelihood=log_likelihood,
+    )
+    os.replace(tmp_model_path, model_path)
+
+    logger.info(
+        f"🏷️ Subject classifier trained on {len(documents)} resources, "
+        f"{len(vocabulary)} features: {model_path}"
+    )
+    return model_path
+
+
+def load_subject_classifier():
+    """
+    Returns the trained classifier, loading it on first use and reloading it
+    when it has been retrained. None if none exists yet.
+    """
+    model_path = os.path.join(settings.NLP_MODEL_DIR, MODEL_FILENAME)
+    try:
+        mtime = os.path.getmtime(model_path)
+    except FileNotFoundError:
+        return None
+
+    if mtime != _loaded["mtime"]:
+        with np.load(model_path) as data:
+            _loaded["model"] = {
+                "classes": [str(subject) for subject in data["classes"]],
+                "index": {str(f): i for i, f in enumerate(data["vocabulary"])},
+                "log_prior": data["log_prior"],
+                "log_likelihood": data["log_likelihood"],
+            }
+        _loaded["mtime"] = mtime
+        logger.info(f"🏷️ Loaded subject classifier ({len(_loaded['model']['index'])} features)")
+
+    return _loaded["model"]
+
+
+def classify_subject(persons, locations, topics):
+    """
+    Returns (subject, confidence) predicted from the extracted metadata, or
+    (None, 0.0) when there is no model yet or none of the features is known.
+    """
+    model = load_subject_classifier()
+    if model is None:
+        return None, 0.0
+
+    columns = [
+        model["index"][feature]
+        for feature in metadata_features(persons, locations, topics)
+        if feature in model["index"]
+    ]
+    if not columns:
+        return None, 0.0
+
+    scores = model["log_prior"] + model["log_likelihood"][:, columns].sum(axis=1)
+    # Softmax of the log scores (shifted by the max for numerical stability)
+    probabilities = np.exp(scores - scores.max())
+    probabilities /= probabilities.sum()
+    best = int(np.argmax(probabilities))
+    return model["classes"][best], float(probabilities[best])
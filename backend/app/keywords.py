@@ -0,0 +1,150 @@
+import logging
+import time
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import KeywordTerm, LessonResource
+from .utils import TextAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Longest term stored in KeywordTerm.term
+MAX_TERM_LENGTH = 100
+
+# Process-wide IDF table: {"loaded_at": float, "index": {term: column}, "idf": ndarray, "default_idf": float}
+_idf_table = {"loaded_at": None}
+
+
+def rebuild_idf_table():
+    """
+    Recomputes the document frequency of every term from scratch over all the
+    stored LessonResource texts. The document-term incidence matrix is built as
+    a SciPy sparse matrix and summed column-wise in one vectorized step.
+    Returns the number of indexed documents.
+    """
+    from scipy import sparse  # Only needed by the bulk rebuild
+
+    vocabulary = {}
+    rows, columns = [], []
+    resource_ids = []
+
+    resources = (
+        LessonResource.objects.exclude(entry_text="")
+        .only("id", "entry_text")
+        .iterator(chunk_size=20)
+    )
+    for row, resource in enumerate(resources):
+        tokens = TextAnalysis(resource.entry_text, profile="lemma").noun_tokens
+        for term in _terms(tokens):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
+        resource_ids.append(resource.id)
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(resource_ids), len(vocabulary)),
+    )
+    document_counts = np.asarray(incidence.sum(axis=0)).ravel()
+
+    with transaction.atomic():
+        KeywordTerm.objects.all().delete()
+        KeywordTerm.objects.bulk_create(
+            [
+                KeywordTerm(term=term, document_count=int(document_counts[column]))
+                for term, column in vocabulary.items()
+            ],
+            batch_size=5000,
+        )
+        LessonResource.objects.update(keywords_indexed=False)
+        LessonResource.objects.filter(id__in=resource_ids).update(keywords_indexed=True)
+
+    _idf_table["loaded_at"] = None  # Force a reload in this process
+    logger.info(
+        f"🔑 IDF table rebuilt: {len(vocabulary)} terms over {len(resource_ids)} documents"
+    )
+    return len(resource_ids)
+
+
+def index_document(lesson_resource, tokens):
+    """
+    Incrementally adds one processed resource to the document frequencies.
+    Idempotent: a resource is only counted once. Terms are written in sorted
+    order, so concurrent workers lock the shared rows in the same order and
+    cannot deadlock.
+    """
+    terms = _terms(tokens)
+    with transaction.atomic():
+        # Claim the resource first so that a retry cannot count it twice
+        claimed = LessonResource.objects.filter(
+            id=lesson_resource.id, keywords_indexed=False
+        ).update(keywords_indexed=True)
+        if not claimed or not terms:
+            return
+        # Create missing terms at 0, then increment them all atomically
+        KeywordTerm.objects.bulk_create(
+            [KeywordTerm(term=term, document_count=0) for term in terms],
+            ignore_conflicts=True,
+            batch_size=5000,
+        )
+        # UPDATE locks rows in scan order: take the locks in term order first
+        list(
+            KeywordTerm.objects.filter(term__in=terms)
+            .order_by("term")
+            .select_for_update()
+            .values_list("id", flat=True)
+        )
+        KeywordTerm.objects.filter(term__in=terms).update(
+            document_count=F("document_count") + 1
+        )
+
+
+def extract_keywords(tokens, num_words=6):
+    """
+    Returns the `num_words` tokens with the highest TF-IDF score, best first.
+    TF is computed with NumPy over the document tokens, IDF comes from the
+    precomputed table (smoothed, so unseen terms get the highest weight).
+    """
+    if not tokens:
+        return []
+
+    terms, counts = np.unique(np.asarray(tokens, dtype=object), return_counts=True)
+    table = _load_idf_table()
+    columns = np.fromiter(
+        (table["index"].get(term, -1) for term in terms), dtype=np.int64, count=len(terms)
+    )
+    idf = np.full(len(terms), table["default_idf"])
+    known = columns >= 0
+    idf[known] = table["idf"][columns[known]]
+    scores = (counts / len(tokens)) * idf
+
+    top = min(num_words, len(terms))
+    best = np.argpartition(-scores, top - 1)[:top]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [str(terms[i]) for i in best]
+
+
+def _terms(tokens):
+    return sorted({token for token in tokens if len(token) <= MAX_TERM_LENGTH})
+
+
+def _load_idf_table():
+    """Loads (or refreshes after KEYWORD_IDF_REFRESH_SECONDS) the IDF table in memory."""
+    loaded_at = _idf_table["loaded_at"]
+    if loaded_at is not None and (
+        time.monotonic() - loaded_at < settings.KEYWORD_IDF_REFRESH_SECONDS
+    ):
+        return _idf_table
+
+    document_total = LessonResource.objects.filter(keywords_indexed=True).count()
+    rows = list(KeywordTerm.objects.values_list("term", "document_count"))
+    document_counts = np.fromiter(
+        (count for _, count in rows), dtype=np.float64, count=len(rows)
+    )
+
+    _idf_table["index"] = {term: column for column, (term, _) in enumerate(rows)}
+    _idf_table["idf"] = np.log((1 + document_total) / (1 + document_counts)) + 1
+    _idf_table["default_idf"] = np.log(1 + document_total) + 1
+    _idf_table["loaded_at"] = time.monotonic()
+    return _idf_table
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import time
+from django.conf import settings
+
+from . import metrics
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "llm:v1:"
+# Keys of the cached responses by last access time (LRU order)
+INDEX_KEY = "llm:index"
+# Size in bytes of each cached response, and the total
+SIZES_KEY = "llm:sizes"
+TOTAL_BYTES_KEY = "llm:bytes"
+
+# Stores a response and evicts the least recently used ones until the cache
+# fits in the byte budget, atomically. Entries already expired by their TTL
+# are forgotten first.
+# KEYS: entry, index, sizes, total bytes
+# ARGV: value, now, ttl, max bytes
+STORE_SCRIPT = """
+local function forget(key)
+    local size = redis.call('HGET', KEYS[3], key)
+    if size then
+        redis.call('DECRBY', KEYS[4], size)
+        redis.call('HDEL', KEYS[3], key)
+    end
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('DEL', key)
+end
+
+local now = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local budget = tonumber(ARGV[4])
+
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now - ttl)) do
+    forget(key)
+end
+
+forget(KEYS[1])
+local size = string.len(ARGV[1])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+redis.call('ZADD', KEYS[2], now, KEYS[1])
+redis.call('HSET', KEYS[3], KEYS[1], size)
+local total = redis.call('INCRBY', KEYS[4], size)
+
+local evicted = 0
+while total > budget do
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, 0)
+    if #oldest == 0 or oldest[1] == KEYS[1] then
+        break
+    end
+    forget(oldest[1])
+    evicted = evicted + 1
+    total = tonumber(redis.call('GET', KEYS[4]))
+end
+return evicted
+"""
+
+_store_script = None
+
+
+def make_key(model_name, generation_config, prompt):
+    """Cache key of a Gemini call: hash of the model, its generation config and the prompt."""
+    payload = json.dumps(
+        [model_name, generation_config, prompt], ensure_ascii=False, sort_keys=True
+    )
+    return KEY_PREFIX + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lookup(key):
+    """
+    Returns the cached response for `key`, or None. A hit refreshes both the
+    LRU position and the TTL of the entry. Cache errors count as misses.
+    """
+    try:
+        client = get_redis()
+        value = client.get(key)
+        if value is None:
+            metrics.incr(metrics.LLM_CACHE_MISSES)
+            return None
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(INDEX_KEY, {key: time.time()}, xx=True)
+        pipe.expire(key, settings.LLM_CACHE_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"LLM cache lookup failed: {e}")
+        metrics.incr(metrics.LLM_CACHE_MISSES)
+        return None
+
+    metrics.incr(metrics.LLM_CACHE_HITS)
+    metrics.incr(metrics.LLM_CACHE_BYTES_SERVED, len(value))
+    return json.loads(value)
+
+
+def store(key, response):
+    """Caches a response, unless it is larger than LLM_CACHE_MAX_ENTRY_BYTES."""
+    global _store_script
+
+    value = json.dumps(response, ensure_ascii=False).encode()
+    if len(value) > settings.LLM_CACHE_MAX_ENTRY_BYTES:
+        logger.info(f"LLM response of {len(value)} bytes not cached (too large)")
+        return
+
+    try:
+        client = get_redis()
+        if _store_script is None:
+            _store_script = client.register_script(STORE_SCRIPT)
+        evicted = _store_script(
+            keys=[key, INDEX_KEY, SIZES_KEY, TOTAL_BYTES_KEY],
+            args=[value, time.time(), settings.LLM_CACHE_TTL, settings.LLM_CACHE_MAX_BYTES],
+        )
+    except Exception as e:
+        logger.warning(f"LLM cache store failed: {e}")
+        return
+
+    if evicted:
+        metrics.incr(metrics.LLM_CACHE_EVICTIONS, evicted)
+
+
+def size_bytes():
+    """Returns the total size of the cached responses, or None if Redis is unreachable."""
+    try:
+        return int(get_redis().get(TOTAL_BYTES_KEY) or 0)
+    except Exception as e:
+        logger.warning(f"Could not read the LLM cache size: {e}")
+        return None
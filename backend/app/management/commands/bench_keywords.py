@@ -0,0 +1,59 @@
+import re
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from app.keywords import extract_keywords
+from app.models import LessonResource
+from app.topic_model import infer_topics
+from app.utils import TextAnalysis
+
+# Words inside an LDA topic string such as '0.045*"roma" + 0.031*"senato"'
+TOPIC_WORD_RE = re.compile(r'"([^"]+)"')
+
+
+class Command(BaseCommand):
+    help = "Compares latency and keyword overlap of the LDA topics and the TF-IDF keywords."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=20, help="Resources to sample")
+        parser.add_argument("--words", type=int, default=6, help="Keywords per document")
+
+    def handle(self, *args, **options):
+        resources = LessonResource.objects.exclude(entry_text="").order_by("-id")[
+            : options["documents"]
+        ]
+        token_lists = [
+            TextAnalysis(resource.entry_text, profile="lemma").noun_tokens
+            for resource in resources
+        ]
+        if not token_lists:
+            raise CommandError("No processed lesson resources to benchmark")
+
+        # Load the topic model and the IDF table before timing
+        infer_topics(token_lists[0])
+        extract_keywords(token_lists[0])
+
+        lda_seconds = tfidf_seconds = 0.0
+        overlaps = []
+        for tokens in token_lists:
+            start = time.perf_counter()
+            topics = infer_topics(tokens, num_words=options["words"])
+            lda_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            keywords = extract_keywords(tokens, num_words=options["words"])
+            tfidf_seconds += time.perf_counter() - start
+
+            lda_words = {word for topic in topics for word in TOPIC_WORD_RE.findall(topic)}
+            union = lda_words | set(keywords)
+            overlaps.append(len(lda_words & set(keywords)) / len(union) if union else 1.0)
+
+        count = len(token_lists)
+        self.stdout.write(f"Documents: {count}")
+        self.stdout.write(f"LDA inference: {1000 * lda_seconds / count:.1f} ms/document")
+        self.stdout.write(f"TF-IDF keywords: {1000 * tfidf_seconds / count:.1f} ms/document")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Mean keyword overlap (Jaccard): {sum(overlaps) / count:.2f}"
+            )
+        )
@@ -0,0 +1,72 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from app.utils import merge_similar_names
+
+# Sillabe usate per generare nomi di persona sintetici
+SYLLABLES = ["ma", "ro", "ti", "lu", "ca", "ne", "vi", "ra", "so", "de", "gu", "st", "io", "an"]
+
+
+def legacy_merge_similar_names(person_counts):
+    """The O(n²) implementation replaced by the trigram index."""
+    sorted_names = sorted(person_counts.items(), key=lambda x: len(x[0]), reverse=True)
+    merged_counts = {}
+
+    for longer_name, count in sorted_names:
+        merged = False
+
+        for existing_name in list(merged_counts.keys()):
+            if longer_name in existing_name or existing_name in longer_name:
+                merged_counts[existing_name] += count
+                merged = True
+                break
+
+        if not merged:
+            merged_counts[longer_name] = count
+
+    return merged_counts
+
+
+def synthetic_names(count, seed):
+    rng = random.Random(seed)
+
+    def word():
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+    names = {}
+    while len(names) < count:
+        names[" ".join(word() for _ in range(rng.randint(1, 3)))] = rng.randint(1, 20)
+    return names
+
+
+class Command(BaseCommand):
+    help = "Benchmarks merge_similar_names against the legacy pairwise implementation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--names", type=int, default=10_000, help="Distinct synthetic names")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        names = synthetic_names(options["names"], options["seed"])
+        self.stdout.write(f"Merging {len(names)} distinct names")
+
+        start = time.perf_counter()
+        legacy = legacy_merge_similar_names(names)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        merged = merge_similar_names(names)
+        indexed_seconds = time.perf_counter() - start
+
+        if list(merged.items()) != list(legacy.items()):
+            raise CommandError("merge_similar_names differs from the legacy implementation")
+
+        self.stdout.write(f"Legacy (pairwise): {legacy_seconds:.3f}s")
+        self.stdout.write(f"Trigram index: {indexed_seconds:.3f}s")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Speedup: {legacy_seconds / indexed_seconds:.1f}x, identical output "
+                f"({len(merged)} merged names)"
+            )
+        )
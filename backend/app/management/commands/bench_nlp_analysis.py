@@ -0,0 +1,70 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from app.utils import (
+    extract_text_from_pdf,
+    basic_cleaning,
+    smart_line_joining,
+    extract_persons_by_frequency,
+    extract_locations,
+    extract_topics_lda,
+    TextAnalysis,
+)
+
+# Paragrafo di esempio ripetuto per costruire un documento italiano di grandi dimensioni
+SAMPLE_PARAGRAPH = (
+    "Nel 31 a.C. Ottaviano sconfisse Marco Antonio e Cleopatra nella battaglia di Azio, "
+    "al largo della Grecia. Tornato a Roma, Ottaviano Augusto ricevette dal Senato poteri "
+    "straordinari e governò l'Italia e le province per oltre quarant'anni. Durante il suo "
+    "principato Virgilio scrisse l'Eneide, Orazio compose le Odi e Tito Livio raccontò la "
+    "storia di Roma dalle origini. Le legioni presidiavano il Reno e il Danubio, mentre "
+    "l'Egitto divenne provincia personale dell'imperatore. "
+)
+
+
+class Command(BaseCommand):
+    help = "Compares the legacy three-parse NLP extraction with the single-parse TextAnalysis."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf", help="Path of a PDF to benchmark (default: synthetic text)")
+        parser.add_argument(
+            "--chars",
+            type=int,
+            default=300_000,
+            help="Size of the synthetic Italian document when no PDF is given",
+        )
+
+    def handle(self, *args, **options):
+        if options["pdf"]:
+            raw_text = extract_text_from_pdf(options["pdf"])
+            if raw_text.startswith("Error extracting text"):
+                raise CommandError(raw_text)
+            text = smart_line_joining(basic_cleaning(raw_text))
+        else:
+            repeats = max(1, options["chars"] // len(SAMPLE_PARAGRAPH))
+            text = SAMPLE_PARAGRAPH * repeats
+
+        self.stdout.write(f"Document size: {len(text)} characters")
+
+        start = time.perf_counter()
+        legacy_persons = extract_persons_by_frequency(text)[:5]
+        legacy_locations = extract_locations(text)[:5]
+        extract_topics_lda(text)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        analysis = TextAnalysis(text)
+        persons = analysis.persons[:5]
+        locations = analysis.locations[:5]
+        analysis.topics()
+        single_seconds = time.perf_counter() - start
+
+        self.stdout.write(f"Legacy (3 parses): {legacy_seconds:.2f}s")
+        self.stdout.write(f"TextAnalysis (1 parse): {single_seconds:.2f}s")
+        self.stdout.write(
+            self.style.SUCCESS(f"Speedup: {legacy_seconds / single_seconds:.2f}x")
+        )
+        self.stdout.write(
+            f"Same persons: {persons == legacy_persons}, "
+            f"same locations: {locations == legacy_locations}"
+        )
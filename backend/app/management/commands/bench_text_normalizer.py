@@ -0,0 +1,75 @@
+import re
+import time
+import unicodedata
+from django.core.management.base import BaseCommand, CommandError
+
+from app.utils import extract_text_from_pdf, normalize_text
+
+# Testo di esempio con simboli, caratteri di controllo e spazi irregolari
+SAMPLE_TEXT = (
+    "● Capitolo 3\x0c\n  La  crisi  della Repubblica� romana\t\n"
+    "Nel I secolo a.C.\x00 le guerre civili​ sconvolsero Roma:\r\n"
+    "Mario e Silla, poi Cesare e Pompeo,   si contesero il potere.\n\n"
+)
+
+
+def legacy_remove_control_chars(text):
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] != "C")
+
+
+def legacy_basic_cleaning(text):
+    """The multi-pass cleaning chain replaced by normalize_text."""
+    text = text.replace("�", "")
+    text = re.sub(r"[●�]+", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return legacy_remove_control_chars(text)
+
+
+class Command(BaseCommand):
+    help = "Measures the throughput (chars/sec) of the text normalizer against the legacy cleaning."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf", help="Path of a PDF to benchmark (default: synthetic text)")
+        parser.add_argument(
+            "--chars",
+            type=int,
+            default=5_000_000,
+            help="Size of the synthetic text when no PDF is given",
+        )
+        parser.add_argument("--rounds", type=int, default=3, help="Best of N runs")
+
+    def handle(self, *args, **options):
+        if options["pdf"]:
+            text = extract_text_from_pdf(options["pdf"])
+            if text.startswith("Error extracting text"):
+                raise CommandError(text)
+        else:
+            text = SAMPLE_TEXT * max(1, options["chars"] // len(SAMPLE_TEXT))
+
+        self.stdout.write(f"Text size: {len(text)} characters")
+
+        legacy_output = legacy_basic_cleaning(text)
+        output = normalize_text(text)  # Also builds the control-char regex once
+        if output != legacy_output:
+            raise CommandError("normalize_text output differs from the legacy cleaning")
+        self.stdout.write("Output identical to the legacy cleaning")
+
+        results = {}
+        for name, function in (
+            ("legacy", legacy_basic_cleaning),
+            ("normalize_text", normalize_text),
+        ):
+            best = None
+            for _ in range(options["rounds"]):
+                start = time.perf_counter()
+                function(text)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = best
+            self.stdout.write(f"{name}: {len(text) / best:,.0f} chars/sec")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Speedup: {results['legacy'] / results['normalize_text']:.2f}x"
+            )
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.keywords import rebuild_idf_table
+
+
+class Command(BaseCommand):
+    help = "Recomputes the TF-IDF document frequencies from all stored lesson resources."
+
+    def handle(self, *args, **options):
+        documents = rebuild_idf_table()
+        self.stdout.write(self.style.SUCCESS(f"IDF table rebuilt over {documents} documents"))
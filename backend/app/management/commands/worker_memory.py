@@ -0,0 +1,98 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+
+PROC = "/proc"
+
+
+def read_cmdline(pid):
+    with open(os.path.join(PROC, str(pid), "cmdline"), "rb") as f:
+        return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+
+
+def read_ppid(pid):
+    with open(os.path.join(PROC, str(pid), "stat")) as f:
+        # The command name (2nd field) may contain spaces: parse after its ")"
+        return int(f.read().rsplit(")", 1)[1].split()[1])
+
+
+def read_memory(pid):
+    """Returns the smaps_rollup counters of a process, in kB."""
+    values = {}
+    with open(os.path.join(PROC, str(pid), "smaps_rollup")) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            parts = value.split()
+            if len(parts) == 2 and parts[1] == "kB":
+                values[key] = int(parts[0])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        # Unique Set Size: the memory freed if the process exited
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+    }
+
+
+def find_celery_workers():
+    """Returns {pid: parent pid} of the running `celery worker` processes (main and children)."""
+    pids = {}
+    for entry in os.listdir(PROC):
+        if not entry.isdigit():
+            continue
+        try:
+            cmdline = read_cmdline(entry)
+            if "celery" in cmdline and "worker" in cmdline:
+                pids[int(entry)] = read_ppid(entry)
+        except OSError:
+            continue  # Exited meanwhile, or not readable
+    return pids
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the memory of the Celery worker processes: RSS, PSS, USS (unique) "
+        "and shared memory of the main process and of each prefork child."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pid", type=int, help="Main worker process (default: autodetect)")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(os.path.join(PROC, "self", "smaps_rollup")):
+            raise CommandError("/proc/<pid>/smaps_rollup is not available on this system")
+
+        pids = find_celery_workers()
+        if options["pid"]:
+            parents = [options["pid"]]
+        else:
+            parents = [pid for pid, ppid in pids.items() if ppid not in pids]
+        if not parents:
+            raise CommandError("No running Celery worker found")
+
+        for parent in parents:
+            children = [pid for pid, ppid in pids.items() if ppid == parent]
+            self.stdout.write(f"Worker {parent}: {len(children)} children")
+            self.stdout.write(
+                f"{'process':>16} {'RSS MB':>9} {'PSS MB':>9} {'USS MB':>9} {'shared MB':>10}"
+            )
+
+            total_uss = 0
+            for label, pid in [("main", parent)] + [(f"child {pid}", pid) for pid in children]:
+                try:
+                    memory = read_memory(pid)
+                except OSError as e:
+                    self.stdout.write(f"{label:>16} unreadable: {e}")
+                    continue
+                if pid != parent:
+                    total_uss += memory["uss"]
+                self.stdout.write(
+                    f"{label:>16} {memory['rss'] / 1024:>9.1f} {memory['pss'] / 1024:>9.1f} "
+                    f"{memory['uss'] / 1024:>9.1f} {memory['shared'] / 1024:>10.1f}"
+                )
+
+            if children:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Average unique memory per child: {total_uss / len(children) / 1024:.1f} MB"
+                    )
+                )
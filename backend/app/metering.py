@@ -0,0 +1,200 @@
+import logging
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from .models import MonthlyAPIUsage, UsageFlush
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# metering:usage:<user_id>:<service>:<year>:<month> -> {counter: delta}
+USAGE_PREFIX = "metering:usage:"
+# Usage keys incremented since the last flush
+DIRTY_KEY = "metering:dirty"
+# Batches taken by a flush and not yet confirmed in the database
+BATCHES_KEY = "metering:batches"
+BATCH_PREFIX = "metering:batch:"
+# metering:month:<user_id>:<year>:<month> -> Gemini tokens used in the month so
+# far, buffered or not: the live counter read by the quota check (app.quota)
+MONTH_PREFIX = "metering:month:"
+MONTH_TTL = 40 * 24 * 3600  # Seconds: outlives the month it counts
+
+# Redis counter -> MonthlyAPIUsage field
+COUNTERS = {
+    "input_tokens": "total_input_tokens",
+    "output_tokens": "total_output_tokens",
+    "characters": "total_characters_processed",
+}
+
+# Rows per INSERT statement of the flush
+UPSERT_BATCH_SIZE = 500
+
+# Days a flushed batch is remembered: far longer than a batch can stay
+# unconfirmed in Redis, far shorter than forever (one row per flush)
+FLUSH_RETENTION_DAYS = 3
+
+# Atomically moves the deltas of every dirty usage key into a new batch hash
+# (field "<user_id>:<service>:<year>:<month>:<counter>") and deletes them:
+# increments recorded meanwhile go to fresh keys, for the next flush.
+# KEYS: dirty set, batches set, batch hash
+# ARGV: batch id, length of USAGE_PREFIX
+TAKE_SCRIPT = """
+local offset = tonumber(ARGV[2]) + 1
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local values = redis.call('HGETALL', key)
+    for i = 1, #values, 2 do
+        redis.call('HINCRBY', KEYS[3], string.sub(key, offset) .. ':' .. values[i], values[i + 1])
+    end
+    redis.call('DEL', key)
+    redis.call('SREM', KEYS[1], key)
+end
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('SADD', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Adds tokens to a monthly counter only if it exists: a missing counter (e.g.
+# after a Redis restart) is seeded from MonthlyAPIUsage by the quota check, and
+# creating it from 0 here would forget the usage already flushed this month.
+# KEYS: monthly tokens counter
+# ARGV: tokens, ttl
+INCR_EXISTING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('INCRBY', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_take_script = None
+_incr_existing_script = None
+
+
+def record_usage(user_id, service, input_tokens=0, output_tokens=0, characters=0):
+    """
+    Meters one API call of `user_id` (e.g. service "gemini" or "azure_tts").
+    Only increments Redis counters: the deltas reach MonthlyAPIUsage in bulk
+    through `flush_usage`, so calls never wait on the usage row lock.
+    """
+    if not user_id:
+        return
+    today = now()
+    deltas = {
+        "input_tokens": input_tokens or 0,
+        "output_tokens": output_tokens or 0,
+        "characters": characters or 0,
+    }
+    key = f"{USAGE_PREFIX}{user_id}:{service}:{today.year}:{today.month}"
+    try:
+        client = get_redis()
+        pipe = client.pipeline()  # MULTI/EXEC: the key is never dirty without its deltas
+        for counter, value in deltas.items():
+            if value:
+                pipe.hincrby(key, counter, int(value))
+        pipe.sadd(DIRTY_KEY, key)
+        tokens = deltas["input_tokens"] + deltas["output_tokens"]
+        if service == "gemini" and tokens:
+            _incr_existing(client)(
+                keys=[monthly_tokens_key(user_id, today.year, today.month)],
+                args=[int(tokens), MONTH_TTL],
+                client=pipe,
+            )
+        pipe.execute()
+    except Exception as e:
+        # Never lose usage: fall back to writing it to the database directly
+        logger.warning(f"Could not buffer {service} usage of user {user_id}, writing it now: {e}")
+        with transaction.atomic():
+            _upsert({(int(user_id), service, today.year, today.month): deltas})
+
+
+def _incr_existing(client):
+    global _incr_existing_script
+
+    if _incr_existing_script is None:
+        _incr_existing_script = client.register_script(INCR_EXISTING_SCRIPT)
+    return _incr_existing_script
+
+
+def monthly_tokens_key(user_id, year, month):
+    """Redis key of the running count of Gemini tokens used by `user_id` in a month."""
+    return f"{MONTH_PREFIX}{user_id}:{year}:{month}"
+
+
+def flush_usage():
+    """
+    Adds the buffered usage deltas to MonthlyAPIUsage with bulk upserts.
+    Each batch is recorded as a UsageFlush in the same transaction as the
+    upserts, so a batch whose flush crashed is retried, and one that was
+    already committed is never added twice; the records older than
+    FLUSH_RETENTION_DAYS are pruned. Returns the number of rows upserted.
+    """
+    global _take_script
+
+    client = get_redis()
+    if _take_script is None:
+        _take_script = client.register_script(TAKE_SCRIPT)
+
+    # Batches left behind by a flush that did not finish
+    batch_ids = [batch_id.decode() for batch_id in client.smembers(BATCHES_KEY)]
+    batch_id = uuid.uuid4().hex
+    if _take_script(
+        keys=[DIRTY_KEY, BATCHES_KEY, BATCH_PREFIX + batch_id],
+        args=[batch_id, len(USAGE_PREFIX)],
+    ):
+        batch_ids.append(batch_id)
+
+    rows = 0
+    for batch_id in batch_ids:
+        rows += _flush_batch(client, batch_id)
+    UsageFlush.objects.filter(
+        flushed_at__lt=now() - timedelta(days=FLUSH_RETENTION_DAYS)
+    ).delete()
+    if rows:
+        logger.info(f"📈 Flushed API usage: {rows} rows from {len(batch_ids)} batches")
+    return rows
+
+
+def _flush_batch(client, batch_id):
+    usage = defaultdict(dict)
+    for field, value in client.hgetall(BATCH_PREFIX + batch_id).items():
+        user_id, service, year, month, counter = field.decode().split(":")
+        usage[(int(user_id), service, int(year), int(month))][counter] = int(value)
+
+    with transaction.atomic():
+        _, created = UsageFlush.objects.get_or_create(batch_id=batch_id)
+        if created:
+            _upsert(usage)
+
+    client.delete(BATCH_PREFIX + batch_id)
+    client.srem(BATCHES_KEY, batch_id)
+    return len(usage) if created else 0
+
+
+def _upsert(usage):
+    """
+    Adds `{(user_id, service, year, month): {counter: delta}}` to MonthlyAPIUsage
+    with multi-row INSERT ... ON CONFLICT DO UPDATE statements (PostgreSQL/SQLite).
+    """
+    table = connection.ops.quote_name(MonthlyAPIUsage._meta.db_table)
+    columns = ["user_id", "service", "year", "month", *COUNTERS.values()]
+    updates = ", ".join(f"{column} = {table}.{column} + EXCLUDED.{column}" for column in COUNTERS.values())
+    rows = [
+        [user_id, service, year, month, *(deltas.get(counter, 0) for counter in COUNTERS)]
+        for (user_id, service, year, month), deltas in usage.items()
+    ]
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start : start + UPSERT_BATCH_SIZE]
+            placeholders = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders} "
+                f"ON CONFLICT (user_id, service, month, year) DO UPDATE SET {updates}",
+                [value for row in batch for value in row],
+            )
@@ -0,0 +1,61 @@
+import logging
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "metrics:"
+
+# Counters exposed by the metrics endpoint
+DEDUP_HITS = "dedup.hits"
+DEDUP_MISSES = "dedup.misses"
+# Subjects answered by the local classifier (hits) instead of Gemini (misses)
+CLASSIFIER_HITS = "classifier.hits"
+CLASSIFIER_MISSES = "classifier.misses"
+# Gemini responses served from / missing in the LLM cache
+LLM_CACHE_HITS = "llm_cache.hits"
+LLM_CACHE_MISSES = "llm_cache.misses"
+LLM_CACHE_BYTES_SERVED = "llm_cache.bytes_served"
+LLM_CACHE_EVICTIONS = "llm_cache.evictions"
+# Malformed JSON responses fixed by repair_json instead of being regenerated
+JSON_REPAIRS = "analysis.json_repairs"
+# Gemini quota errors (429) and time spent waiting for the rate limiter
+GEMINI_THROTTLED = "gemini.throttled"
+GEMINI_RATE_LIMIT_WAIT_MS = "gemini.rate_limit_wait_ms"
+
+METRIC_NAMES = [
+    DEDUP_HITS,
+    DEDUP_MISSES,
+    CLASSIFIER_HITS,
+    CLASSIFIER_MISSES,
+    LLM_CACHE_HITS,
+    LLM_CACHE_MISSES,
+    LLM_CACHE_BYTES_SERVED,
+    LLM_CACHE_EVICTIONS,
+    JSON_REPAIRS,
+    GEMINI_THROTTLED,
+    GEMINI_RATE_LIMIT_WAIT_MS,
+]
+
+
+def incr(name, amount=1):
+    """
+    Atomically increments a counter in the shared cache (Redis).
+    Metrics must never break the request, so cache errors are only logged.
+    """
+    key = METRICS_PREFIX + name
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+    except Exception as e:
+        logger.warning(f"Could not increment metric {name}: {e}")
+
+
+def snapshot(names=None):
+    """Returns the current value of the given counters (all known ones by default)."""
+    names = names or METRIC_NAMES
+    try:
+        values = cache.get_many([METRICS_PREFIX + name for name in names])
+    except Exception as e:
+        logger.warning(f"Could not read metrics: {e}")
+        values = {}
+    return {name: values.get(METRICS_PREFIX + name, 0) for name in names}
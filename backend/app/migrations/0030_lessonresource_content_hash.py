@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0029_mentionedperson_bio_alter_mentionedperson_image_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonresource',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
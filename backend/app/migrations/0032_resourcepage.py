@@ -0,0 +1,30 @@
+# Generated by Django 5.1.5 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0031_lessonresource_metadata_processedcontent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourcePage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('char_start', models.PositiveIntegerField(default=0)),
+                ('char_end', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done')], default='pending', max_length=10)),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='app.lessonresource')),
+            ],
+            options={
+                'ordering': ['page_number'],
+                'unique_together': {('resource', 'page_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0032_resourcepage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonresource',
+            name='keywords_indexed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='KeywordTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
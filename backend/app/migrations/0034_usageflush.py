@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0033_keywordterm_lessonresource_keywords_indexed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageFlush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=32, unique=True)),
+                ('flushed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -77,6 +77,19 @@ class MonthlyAPIUsage(models.Model):
         return f"{self.user.username} - {self.service} - {self.month}/{self.year}"
 
 
+class UsageFlush(models.Model):
+    """
+    A batch of metered API usage already added to MonthlyAPIUsage: recorded in
+    the same transaction, so a batch is never counted twice (see app.metering).
+    """
+
+    batch_id = models.CharField(max_length=32, unique=True)
+    flushed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Usage batch {self.batch_id}"
+
+
 class ConceptMap(models.Model):
     """Stores a conceptual map in JSON format for easy retrieval and modification."""
 
@@ -438,6 +451,15 @@ class LessonResource(models.Model):
     file = models.FileField(upload_to="", blank=True, null=True)
     entry_text = models.TextField(blank=True)
     subject = models.TextField(blank=True)
+    content_hash = models.CharField(
+        max_length=64, blank=True, db_index=True
+    )  # SHA-256 of the uploaded file, computed while it is stored
+    metadata = models.JSONField(
+        default=dict, blank=True
+    )  # Extracted persons, locations and topics
+    keywords_indexed = models.BooleanField(
+        default=False
+    )  # Counted in the KeywordTerm document frequencies
     uploaded_at = models.DateTimeField(auto_now_add=True)
     resource_type = models.CharField(
         max_length=10, choices=ResourceType.choices, default=ResourceType.OTHER
@@ -446,6 +468,77 @@ class LessonResource(models.Model):
     class Meta:
         db_table = "app_lessonresource"  # Keep custom table name
 
+    def iter_page_texts(self, start=None, stop=None):
+        """
+        Lazily yields the extracted text of pages [start, stop) in order,
+        without loading the whole document in memory.
+        """
+        pages = self.pages.filter(status=ResourcePage.Status.DONE)
+        if start is not None:
+            pages = pages.filter(page_number__gte=start)
+        if stop is not None:
+            pages = pages.filter(page_number__lt=stop)
+        return pages.order_by("page_number").values_list("text", flat=True).iterator(
+            chunk_size=50
+        )
+
+
+class KeywordTerm(models.Model):
+    """Document frequency of a term over the LessonResource corpus (TF-IDF keywords)."""
+
+    term = models.CharField(max_length=100, unique=True)
+    document_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.term} ({self.document_count})"
+
+
+class ResourcePage(models.Model):
+    """Text extracted from one page of a resource, so processing can resume."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        DONE = "done", "Done"
+
+    resource = models.ForeignKey(
+        LessonResource, on_delete=models.CASCADE, related_name="pages"
+    )
+    page_number = models.PositiveIntegerField()  # 0-based
+    text = models.TextField(blank=True)
+    char_start = models.PositiveIntegerField(
+        default=0
+    )  # Offset of the page in the newline-joined raw text
+    char_end = models.PositiveIntegerField(default=0)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+
+    class Meta:
+        unique_together = ("resource", "page_number")
+        ordering = ["page_number"]
+
+    def __str__(self):
+        return f"Page {self.page_number} of resource {self.resource_id} ({self.status})"
+
+
+class ProcessedContent(models.Model):
+    """Content-addressed results of process_pdf_task, reused for identical uploads."""
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    entry_text = models.TextField(blank=True)
+    subject = models.TextField(blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def apply_to(self, lesson_resource):
+        """Copies the cached extraction results onto a resource (not saved)."""
+        lesson_resource.entry_text = self.entry_text
+        lesson_resource.subject = self.subject
+        lesson_resource.metadata = self.metadata
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.subject})"
+
 
 class Task(models.Model):
     STATUS_CHOICES = [
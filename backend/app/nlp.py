@@ -0,0 +1,61 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# spaCy Italian NLP model
+SPACY_MODEL = "it_core_news_sm"
+
+# Loaded resources, by name. Nothing is loaded at import time: web processes
+# (gunicorn, manage.py) import this module through app.tasks but never use it.
+_resources = {}
+_lock = threading.Lock()
+
+
+def get_nlp():
+    """Returns the spaCy pipeline, loading it on first use."""
+    return _get("nlp", _load_spacy)
+
+
+def get_stop_words():
+    """Returns the Italian NLTK stopwords, downloading them only if missing."""
+    return _get("stop_words", _load_stop_words)
+
+
+def warm_up():
+    """
+    Loads every NLP resource up front. Only called by Celery workers, so the
+    first task does not pay the model loading time.
+    """
+    get_nlp()
+    get_stop_words()
+
+
+def _get(name, loader):
+    resource = _resources.get(name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(name)
+            if resource is None:
+                logger.info(f"🧠 Loading NLP resource '{name}'")
+                resource = _resources[name] = loader()
+    return resource
+
+
+def _load_spacy():
+    import spacy
+
+    return spacy.load(SPACY_MODEL)
+
+
+def _load_stop_words():
+    import nltk
+    from nltk.corpus import stopwords
+
+    try:
+        words = stopwords.words("italian")
+    except LookupError:
+        # Ensure stopwords are downloaded (network call, only the first time)
+        nltk.download("stopwords", quiet=True)
+        words = stopwords.words("italian")
+    return frozenset(words)
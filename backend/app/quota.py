@@ -0,0 +1,218 @@
+import logging
+import time
+import uuid
+from datetime import datetime, time as day_time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .metering import MONTH_TTL, monthly_tokens_key
+from .models import CustomUser, MonthlyAPIUsage, Subscription
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Plan of the users without an active, unexpired subscription (see QUOTA_PLANS)
+NO_PLAN = "NONE"
+
+PLAN_KEY_PREFIX = "quota:plan:"
+# quota:jobs:<user_id> -> AI jobs in progress, sorted by lease expiry
+JOBS_KEY_PREFIX = "quota:jobs:"
+
+# Admits a job if the user is under both the monthly token quota and the
+# number of jobs in progress, and takes a job lease, atomically. Leases expire
+# on their own, so a job that never finishes cannot block the user forever.
+# Returns "ok", "tokens", "jobs", or "seed" if the token counter is missing.
+# KEYS: monthly tokens counter, jobs sorted set
+# ARGV: now, job id, job timeout, monthly tokens (-1: unlimited), max jobs (-1: unlimited)
+RESERVE_SCRIPT = """
+local token_limit = tonumber(ARGV[4])
+if token_limit >= 0 then
+    local used = redis.call('GET', KEYS[1])
+    if not used then
+        return 'seed'
+    end
+    if tonumber(used) >= token_limit then
+        return 'tokens'
+    end
+end
+
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local max_jobs = tonumber(ARGV[5])
+if max_jobs >= 0 and redis.call('ZCARD', KEYS[2]) >= max_jobs then
+    return 'jobs'
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 'ok'
+"""
+
+REASONS = {
+    "tokens": "Monthly AI quota exhausted",
+    "jobs": "Too many AI jobs in progress, retry when they are finished",
+}
+
+_reserve_script = None
+
+# In-process caches, so that most checks do not leave the process:
+# {user_id: (expires_at, plan)} and {user_id: (expires_at, reason)} for
+# users over their monthly tokens (usage only grows within a month)
+_plans = {}
+_rejections = {}
+
+
+class QuotaExceeded(Exception):
+    """The user cannot start more AI work now; the message says why."""
+
+
+def reserve_job(user_id):
+    """
+    Admits one AI job (PDF processing, lesson analysis) of `user_id` before it
+    is dispatched, from cached entitlements and live usage counters only.
+    Returns the job id to pass to `release_job` once the job is finished, or
+    raises QuotaExceeded. If Redis is unreachable, jobs are not limited.
+    """
+    if not settings.QUOTA_ENABLED:
+        return None
+
+    rejection = _rejections.get(user_id)
+    if rejection and rejection[0] > time.monotonic():
+        raise QuotaExceeded(rejection[1])
+
+    limits = settings.QUOTA_PLANS.get(get_plan(user_id), settings.QUOTA_PLANS[NO_PLAN])
+    monthly_tokens = limits["monthly_tokens"]
+    max_jobs = limits["max_jobs"]
+    job = f"{user_id}:{uuid.uuid4().hex}"
+    today = timezone.now()
+    tokens_key = monthly_tokens_key(user_id, today.year, today.month)
+
+    try:
+        client = get_redis()
+        result = _reserve(client, tokens_key, user_id, job, monthly_tokens, max_jobs)
+        if result == b"seed":
+            _seed_monthly_tokens(client, tokens_key, user_id, today)
+            result = _reserve(client, tokens_key, user_id, job, monthly_tokens, max_jobs)
+    except Exception as e:
+        logger.warning(f"Quota check unavailable, not limiting user {user_id}: {e}")
+        return None
+
+    reason = result.decode()
+    if reason == "ok":
+        return job
+    if reason == "tokens":
+        _rejections[user_id] = (
+            time.monotonic() + settings.QUOTA_LOCAL_CACHE_SECONDS,
+            REASONS[reason],
+        )
+    logger.info(f"🚫 AI job of user {user_id} rejected: {reason}")
+    raise QuotaExceeded(REASONS[reason])
+
+
+def release_job(job):
+    """Frees the job slot taken by `reserve_job` (no-op for None)."""
+    if not job:
+        return
+    user_id = job.split(":", 1)[0]
+    try:
+        get_redis().zrem(JOBS_KEY_PREFIX + user_id, job)
+    except Exception as e:
+        logger.warning(f"Could not release AI job {job}: {e}")
+
+
+def get_plan(user_id):
+    """
+    Returns the QUOTA_PLANS entry name of `user_id`: the subscription type, or
+    NO_PLAN. Cached in the process and in the shared cache; a cached plan
+    expires with the subscription and is dropped when it changes.
+    """
+    cached = _plans.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    key = PLAN_KEY_PREFIX + str(user_id)
+    try:
+        plan = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Could not read the cached plan of user {user_id}: {e}")
+        plan = None
+    if plan is None:
+        plan, timeout = _load_plan(user_id)
+        try:
+            cache.set(key, plan, timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Could not cache the plan of user {user_id}: {e}")
+
+    _plans[user_id] = (time.monotonic() + settings.QUOTA_LOCAL_CACHE_SECONDS, plan)
+    return plan
+
+
+def forget_plan(user_id):
+    """Drops the cached plan of `user_id` (the other processes keep theirs for QUOTA_LOCAL_CACHE_SECONDS)."""
+    _plans.pop(user_id, None)
+    _rejections.pop(user_id, None)
+    try:
+        cache.delete(PLAN_KEY_PREFIX + str(user_id))
+    except Exception as e:
+        logger.warning(f"Could not drop the cached plan of user {user_id}: {e}")
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_saved(sender, instance, **kwargs):
+    for user_id in CustomUser.objects.filter(subscription=instance).values_list("pk", flat=True):
+        forget_plan(user_id)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, **kwargs):
+    # The subscription may have been assigned or removed
+    forget_plan(instance.pk)
+
+
+def _load_plan(user_id):
+    """Returns (plan, seconds it can be cached) from the user's subscription."""
+    timeout = settings.QUOTA_PLAN_CACHE_SECONDS
+    subscription = Subscription.objects.filter(user__pk=user_id).first()
+    if subscription is None or not subscription.is_active:
+        return NO_PLAN, timeout
+
+    if subscription.expiry_date:
+        today = timezone.localdate()
+        if subscription.expiry_date < today:
+            return NO_PLAN, timeout
+        # Valid through the expiry date: not cached past its end
+        expires_at = timezone.make_aware(
+            datetime.combine(subscription.expiry_date + timedelta(days=1), day_time.min)
+        )
+        timeout = max(1, min(timeout, int((expires_at - timezone.now()).total_seconds())))
+    return subscription.subscription_type, timeout
+
+
+def _reserve(client, tokens_key, user_id, job, monthly_tokens, max_jobs):
+    global _reserve_script
+
+    if _reserve_script is None:
+        _reserve_script = client.register_script(RESERVE_SCRIPT)
+    return _reserve_script(
+        keys=[tokens_key, JOBS_KEY_PREFIX + str(user_id)],
+        args=[
+            time.time(),
+            job,
+            settings.QUOTA_JOB_TIMEOUT,
+            -1 if monthly_tokens is None else monthly_tokens,
+            -1 if max_jobs is None else max_jobs,
+        ],
+    )
+
+
+def _seed_monthly_tokens(client, tokens_key, user_id, today):
+    """Starts the live token counter of the month from MonthlyAPIUsage (e.g. after a Redis restart)."""
+    used = MonthlyAPIUsage.objects.filter(
+        user_id=user_id, service="gemini", year=today.year, month=today.month
+    ).aggregate(total=Sum(F("total_input_tokens") + F("total_output_tokens")))["total"]
+    # NX: another check may have seeded it meanwhile (record_usage never
+    # creates the counter, it only adds to an existing one)
+    client.set(tokens_key, used or 0, ex=MONTH_TTL, nx=True)
@@ -0,0 +1,222 @@
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+
+from . import metrics
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ratelimit:"
+
+# Token bucket over requests/min and tokens/min, refilled continuously.
+# Takes 1 request and ARGV[4] tokens if both are available and returns 0,
+# otherwise takes nothing and returns the seconds to wait.
+# KEYS: bucket hash
+# ARGV: now, requests per minute, tokens per minute, tokens
+BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local cost = math.min(tonumber(ARGV[4]), tpm)
+
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+requests = math.min(rpm, requests + elapsed * rpm / 60)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60)
+
+local wait = 0
+if requests < 1 then
+    wait = (1 - requests) * 60 / rpm
+end
+if tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60 / tpm)
+end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+# Takes a concurrency lease if fewer than `limit` calls are in flight.
+# Leases expire on their own, so a crashed worker cannot leak them.
+# KEYS: leases sorted set (by expiry), state hash
+# ARGV: now, lease id, lease timeout, initial limit
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[4])
+if redis.call('ZCARD', KEYS[1]) < math.max(1, math.floor(limit)) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# AIMD: the concurrency limit grows by ~1 per round of successful calls and
+# is halved on a quota error (at most once per cooldown, so that a burst of
+# 429s from the same overload only counts once).
+# KEYS: state hash
+# ARGV: now, throttled (0/1), min limit, max limit, initial limit, cooldown
+ADJUST_SCRIPT = """
+local now = tonumber(ARGV[1])
+local min_limit = tonumber(ARGV[3])
+local max_limit = tonumber(ARGV[4])
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit')) or tonumber(ARGV[5])
+if ARGV[2] == '1' then
+    local decreased_at = tonumber(redis.call('HGET', KEYS[1], 'decreased_at')) or 0
+    if now - decreased_at >= tonumber(ARGV[6]) then
+        limit = math.max(min_limit, limit / 2)
+        redis.call('HSET', KEYS[1], 'decreased_at', now)
+    end
+else
+    limit = math.min(max_limit, limit + 1 / limit)
+end
+redis.call('HSET', KEYS[1], 'limit', limit)
+return tostring(limit)
+"""
+
+_scripts = {}
+
+
+class RateLimitTimeout(Exception):
+    """No Gemini capacity became available within GEMINI_RATE_LIMIT_MAX_WAIT."""
+
+
+class Reservation:
+    """Capacity reserved for one Gemini call."""
+
+    def __init__(self, model_name, reserved_tokens):
+        self.model_name = model_name
+        self.reserved_tokens = reserved_tokens
+
+    def record_usage(self, tokens):
+        """Corrects the tokens/min bucket with the tokens actually used by the call."""
+        difference = tokens - self.reserved_tokens
+        if not difference:
+            return
+        try:
+            get_redis().hincrbyfloat(_key(self.model_name, "bucket"), "tokens", -difference)
+        except Exception as e:
+            logger.warning(f"Could not record Gemini token usage: {e}")
+
+
+@contextmanager
+def acquire(model_name, estimated_tokens, throttle_errors=()):
+    """
+    Waits for cluster-wide capacity to call `model_name`: a concurrency lease
+    (adaptive limit) and one request plus `estimated_tokens` from the token
+    bucket. Exceptions in `throttle_errors` raised by the call (quota errors)
+    halve the concurrency limit; successful calls raise it slowly.
+    If Redis is unreachable, calls are not limited.
+    """
+    lease_id = uuid.uuid4().hex
+    try:
+        leased = _wait_for_capacity(model_name, estimated_tokens, lease_id)
+    except RateLimitTimeout:
+        raise
+    except Exception as e:
+        logger.warning(f"Gemini rate limiter unavailable, not limiting: {e}")
+        leased = False
+
+    throttled = False
+    try:
+        yield Reservation(model_name, estimated_tokens)
+    except throttle_errors:
+        throttled = True
+        metrics.incr(metrics.GEMINI_THROTTLED)
+        raise
+    finally:
+        if leased:
+            _release(model_name, lease_id, throttled)
+
+
+def _wait_for_capacity(model_name, estimated_tokens, lease_id):
+    limits = _limits(model_name)
+    client = get_redis()
+    started = time.monotonic()
+    deadline = started + settings.GEMINI_RATE_LIMIT_MAX_WAIT
+
+    # First a concurrency lease, then the tokens: tokens are never taken by a
+    # call that still has to wait for a slot
+    while not _script(client, "acquire", ACQUIRE_SCRIPT)(
+        keys=[_key(model_name, "leases"), _key(model_name, "state")],
+        args=[time.time(), lease_id, settings.GEMINI_LEASE_TIMEOUT, limits["max_concurrency"]],
+    ):
+        _sleep_until(deadline, 0.1 + random.random() * 0.2)
+
+    try:
+        while True:
+            wait = float(
+                _script(client, "bucket", BUCKET_SCRIPT)(
+                    keys=[_key(model_name, "bucket")],
+                    args=[time.time(), limits["rpm"], limits["tpm"], estimated_tokens],
+                )
+            )
+            if not wait:
+                break
+            # Jitter, so that waiting workers do not all retry at the same instant
+            _sleep_until(deadline, wait + random.random() * 0.1)
+    except BaseException:
+        client.zrem(_key(model_name, "leases"), lease_id)
+        raise
+
+    waited = time.monotonic() - started
+    if waited >= 0.001:
+        metrics.incr(metrics.GEMINI_RATE_LIMIT_WAIT_MS, int(waited * 1000))
+    return True
+
+
+def _release(model_name, lease_id, throttled):
+    limits = _limits(model_name)
+    try:
+        client = get_redis()
+        client.zrem(_key(model_name, "leases"), lease_id)
+        limit = _script(client, "adjust", ADJUST_SCRIPT)(
+            keys=[_key(model_name, "state")],
+            args=[
+                time.time(),
+                1 if throttled else 0,
+                settings.GEMINI_MIN_CONCURRENCY,
+                limits["max_concurrency"],
+                limits["max_concurrency"],
+                settings.GEMINI_THROTTLE_COOLDOWN,
+            ],
+        )
+        if throttled:
+            logger.warning(f"🐢 Gemini quota exceeded: concurrency limit of {model_name} now {float(limit):.1f}")
+    except Exception as e:
+        logger.warning(f"Could not release the Gemini concurrency lease: {e}")
+
+
+def _sleep_until(deadline, seconds):
+    if time.monotonic() + seconds > deadline:
+        raise RateLimitTimeout(
+            f"No Gemini capacity within {settings.GEMINI_RATE_LIMIT_MAX_WAIT} seconds"
+        )
+    time.sleep(seconds)
+
+
+def _limits(model_name):
+    limits = settings.GEMINI_RATE_LIMITS
+    return {**limits["default"], **limits.get(model_name, {})}
+
+
+def _key(model_name, name):
+    return f"{KEY_PREFIX}{model_name}:{name}"
+
+
+def _script(client, name, source):
+    script = _scripts.get(name)
+    if script is None:
+        script = _scripts[name] = client.register_script(source)
+    return script
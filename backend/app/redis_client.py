@@ -0,0 +1,20 @@
+import threading
+import redis
+from django.conf import settings
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_redis():
+    """
+    Returns a process-wide Redis client on the same database as the default
+    Django cache, for the data structures the cache API does not expose
+    (sorted sets, hashes, Lua scripts). The connection pool is fork-safe.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+    return _client
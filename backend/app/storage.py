@@ -0,0 +1,52 @@
+import hashlib
+from django.core.files import File
+
+
+class HashingFile(File):
+    """
+    Wraps an in-memory upload so that its SHA-256 is computed while the storage
+    backend streams it to disk: the upload is read and written exactly once.
+    (It hides `temporary_file_path`, so it is not used for spooled uploads.)
+    """
+
+    def __init__(self, uploaded_file):
+        super().__init__(uploaded_file, name=uploaded_file.name)
+        self._sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size):
+            self._sha256.update(chunk)
+            yield chunk
+
+    @property
+    def content_hash(self):
+        return self._sha256.hexdigest()
+
+
+def store_upload(lesson_resource, uploaded_file):
+    """
+    Saves an uploaded file into `lesson_resource.file` with at most one write
+    and records its content hash. The resource itself is not saved.
+    - Small uploads (in memory) are hashed while they are streamed to disk
+    - Large uploads (spooled to a temporary file, above
+      FILE_UPLOAD_MAX_MEMORY_SIZE) are hashed by reading the temporary file,
+      then moved into place by the storage instead of being copied
+    """
+    if hasattr(uploaded_file, "temporary_file_path"):
+        content_hash = file_sha256(uploaded_file.temporary_file_path())
+        lesson_resource.file.save(uploaded_file.name, uploaded_file, save=False)
+    else:
+        upload = HashingFile(uploaded_file)
+        lesson_resource.file.save(uploaded_file.name, upload, save=False)
+        content_hash = upload.content_hash
+    lesson_resource.content_hash = content_hash
+    return content_hash
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 of a file on disk, read in chunks."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
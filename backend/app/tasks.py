@@ -1,26 +1,49 @@
 import logging
-from celery import shared_task
+from celery import chord, group, shared_task
+from celery.utils.time import get_exponential_backoff_interval
 from .models import (
     LessonResource,
     Lesson,
     MonthlyAPIUsage,
     ConceptMap,
-    Summary,
-    KeyConcepts,
-    Table,
-    Timeline,
-    MentionedPerson
+    ProcessedContent,
+    ResourcePage,
 )
 from .utils import (
-    extract_text_from_pdf,
-    basic_cleaning,
-    smart_line_joining,
-    extract_persons_by_frequency,
-    extract_locations,
-    extract_topics_lda,
+    iter_pdf_pages,
+    count_pdf_pages,
+    text_pipeline,
+    chunk_paragraphs,
+    TextAnalysis,
 )
-from .aifunctions import generate_response_from_google
-from django.db import transaction
+from .aifunctions import GeminiTransientError, generate_response_from_google
+from .topic_model import infer_topics, train_topic_model
+from .keywords import extract_keywords, index_document
+from .classifier import (
+    SUBJECTS,
+    SOURCE_CLASSIFIER,
+    SOURCE_LLM,
+    classify_subject,
+    train_subject_classifier,
+)
+from .analysis import (
+    ARTIFACTS,
+    STREAMED_ARTIFACTS,
+    StreamingArrayParser,
+    artifact_generation_config,
+    build_artifact_prompt,
+    chunk_key_concepts_count,
+    clear_artifact,
+    fetch_people_images,
+    merge_artifact,
+    parse_analysis_response,
+    persist_artifact,
+    persist_artifact_item,
+)
+from .metering import flush_usage
+from .quota import release_job
+from . import metrics
+from django.db import InterfaceError, OperationalError, transaction
 from django.utils.timezone import now
 from django.db.models import F
 from django.contrib.auth import get_user_model
@@ -30,93 +53,153 @@ from django.conf import settings
 import os
 import shutil
 from django.core.files.storage import FileSystemStorage
-import json
-import re
 
 logger = logging.getLogger(__name__)
 
+# Failures worth retrying later: Gemini overload/quota/timeouts, lost DB connections
+TRANSIENT_ERRORS = (GeminiTransientError, OperationalError, InterfaceError)
+
+# Retry policy of the pipeline tasks: exponential backoff (2, 4, 8... seconds,
+# at most 10 minutes) with full jitter, so that the tasks that failed together
+# do not all come back at the same time. Every stage is idempotent, so tasks
+# are acknowledged late and redelivered if a worker dies.
+RETRY_POLICY = {
+    "autoretry_for": TRANSIENT_ERRORS,
+    "max_retries": 5,
+    "retry_backoff": 2,
+    "retry_backoff_max": 600,
+    "retry_jitter": True,
+    "acks_late": True,
+}
 
-@shared_task(bind=True, max_retries=3)
-def process_pdf_task(self, lesson_id, lesson_resource_id, file_path):
+@shared_task(bind=True, **RETRY_POLICY)
+def process_pdf_task(self, lesson_id, lesson_resource_id, file_path=None, quota_job=None):
+    """
+    Processes the PDF, extracts metadata, classifies the subject, and tracks API costs.
+    The PDF is read from `LessonResource.file`; `file_path` is only passed by
+    uploads queued before the single-write ingest path and is deleted afterwards.
+    Transient failures are retried (see RETRY_POLICY); a retry resumes from the
+    last checkpoint: extracted pages are kept, a committed result is not redone.
+    The user's job slot (`quota_job`, see app.quota) is freed once the task
+    no longer retries.
+    """
     print("lesson_id", lesson_id)
     print("lesson_resource_id", lesson_resource_id)
-    """Processes the PDF, extracts metadata, classifies the subject, and tracks API costs."""
+    retrying = False
     try:
         lesson = Lesson.objects.get(pk=lesson_id)
 
         # Retrieve the existing LessonResource by ID
         lesson_resource = LessonResource.objects.get(id=lesson_resource_id)
 
-        # Start processing the PDF
-        with open(file_path, "rb") as pdf_file:
-            raw_text = extract_text_from_pdf(pdf_file)
-            full_text_cleaned = basic_cleaning(raw_text)
-            full_text_further_processed = smart_line_joining(full_text_cleaned)
-
-            # Extract metadata
-            extracted_persons = extract_persons_by_frequency(
-                full_text_further_processed
-            )[:5]
-            extracted_locations = extract_locations(full_text_further_processed)[:5]
-            extracted_topics = extract_topics_lda(full_text_further_processed)
-            prompt = (
-                "Classifica l'argomento principale del testo tra le seguenti opzioni: "
-                "Storia, Scienza, Matematica, Filosofia, Letteratura, Geografia, Arte, Economia, Informatica, Altro.\n\n"
-                "Ecco le informazioni chiave estratte:\n"
-                f"- **Persone citate**: {', '.join([p[0] for p in extracted_persons]) if extracted_persons else 'Nessuna'}\n"
-                f"- **Luoghi menzionati**: {', '.join([l[0] for l in extracted_locations]) if extracted_locations else 'Nessuno'}\n"
-                f"- **Temi principali**: {', '.join(extracted_topics) if extracted_topics else 'Non identificati'}\n\n"
-                "Rispondi solo con il nome della categoria in italiano, senza testo aggiuntivo."
-            )
-            # Call Google Gemini API
-            response_data = generate_response_from_google(prompt)
-            subject = (
-                response_data["text"].strip() if response_data["text"] else "Altro"
-            )
-            input_tokens = response_data.get("input_tokens", 0)
-            output_tokens = response_data.get("output_tokens", 0)
+        # Checkpoint: the results are committed together, so a resource with a
+        # subject has been completely processed (e.g. by a redelivered task)
+        if lesson_resource.subject and lesson_resource.entry_text:
+            logger.info(f"⏭️ LessonResource {lesson_resource_id} already processed")
+            return {
+                "status": "success",
+                "message": f"Text extracted and classified as {lesson_resource.subject}",
+            }
 
+        # An identical upload may have been processed while this one was queued
+        processed = (
+            ProcessedContent.objects.filter(content_hash=lesson_resource.content_hash)
+            .first()
+            if lesson_resource.content_hash
+            else None
+        )
+        if processed:
+            processed.apply_to(lesson_resource)
+            lesson_resource.save()
             logger.info(
-                f"📊 Token usage - Input: {input_tokens}, Output: {output_tokens}"
+                f"♻️ Reused processed content {processed.content_hash} for LessonResource {lesson_resource_id}"
             )
+            return {
+                "status": "success",
+                "message": f"Reused cached extraction classified as {processed.subject}",
+            }
 
-        # 🔥 Aggregate Monthly API Usage
-        # current_month = now().month
-        # current_year = now().year
-
-        # Update existing record OR create a new one if it doesn't exist
-        # monthly_usage, created = MonthlyAPIUsage.objects.get_or_create(
-        #    service="gemini",
-        #    month=current_month,
-        #    year=current_year,
-        #    defaults={
-        #        "total_input_tokens": 0,
-        #        "total_output_tokens": 0,
-        #       "total_characters_processed": 0,
-        #    },
-        # )
-
-        # Update token counts atomically
-        # TBF
-        # MonthlyAPIUsage.objects.filter(id=1).update(
-        #    total_input_tokens=F("total_input_tokens") + input_tokens,
-        #    total_output_tokens=F("total_output_tokens") + output_tokens,
-        # )
+        # Start processing the PDF (by path, so page ranges can be read in parallel)
+        pdf_path = file_path or lesson_resource.file.path
+        extract_resource_pages(lesson_resource, pdf_path)
+
+        # Stream the stored pages through clean -> join -> chunk
+        chunks = list(text_pipeline(lesson_resource.iter_page_texts()))
+
+        # Extract metadata (the chunks are parsed by spaCy only once, in batches)
+        analysis = TextAnalysis(chunks)
+        # Joined once spaCy is done, and the chunks dropped: the text is not
+        # held twice while it is parsed, nor for the rest of the task
+        full_text_further_processed = " ".join(chunks)
+        del chunks
+        extracted_persons = analysis.persons[:5]
+        extracted_locations = analysis.locations[:5]
+        if settings.KEYWORD_EXTRACTOR == "tfidf":
+            extracted_topics = extract_keywords(analysis.noun_tokens)
+        else:
+            # Inference on the corpus-level topic model (no per-upload training)
+            extracted_topics = infer_topics(analysis.noun_tokens)
+        # Try the local classifier first: Gemini is only asked when it is unsure
+        subject, confidence = classify_subject(
+            extracted_persons, extracted_locations, extracted_topics
+        )
+        if subject and confidence >= settings.SUBJECT_CLASSIFIER_THRESHOLD:
+            metrics.incr(metrics.CLASSIFIER_HITS)
+            subject_source = SOURCE_CLASSIFIER
+            logger.info(f"🏷️ Classified locally as {subject} ({confidence:.2f})")
+        else:
+            metrics.incr(metrics.CLASSIFIER_MISSES)
+            subject_source = SOURCE_LLM
+            subject = classify_subject_with_llm(
+                extracted_persons,
+                extracted_locations,
+                extracted_topics,
+                user_id=lesson.project.created_by_id,
+            )
 
         # 🔥 Update the existing LessonResource
+        metadata = {
+            "persons": extracted_persons,
+            "locations": extracted_locations,
+            "topics": extracted_topics,
+            "subject_source": subject_source,
+        }
         with transaction.atomic():
             lesson_resource.entry_text = full_text_further_processed
             lesson_resource.subject = subject
+            lesson_resource.metadata = metadata
             lesson_resource.save()
 
+            # Index the results by content hash for future identical uploads
+            if lesson_resource.content_hash:
+                ProcessedContent.objects.get_or_create(
+                    content_hash=lesson_resource.content_hash,
+                    defaults={
+                        "entry_text": full_text_further_processed,
+                        "subject": subject,
+                        "metadata": metadata,
+                    },
+                )
+
+        # Keep the TF-IDF document frequencies up to date, only when they are
+        # used, and in a transaction of their own: the hot KeywordTerm rows
+        # are not locked while the resource is saved
+        if settings.KEYWORD_EXTRACTOR == "tfidf":
+            try:
+                index_document(lesson_resource, analysis.noun_tokens)
+            except Exception as e:
+                # The resource stays unindexed until `rebuild_keyword_index`
+                logger.warning(
+                    f"Could not index the keywords of LessonResource {lesson_resource_id}: {e}"
+                )
+
         logger.info(
             f"✅ Successfully updated LessonResource with ID {lesson_resource_id} for lesson {lesson_id}"
         )
-        if os.path.exists(file_path):  # Check if the file exists
+        # Legacy uploads kept a second copy of the PDF only for this task
+        if file_path and os.path.exists(file_path):
             os.remove(file_path)  # Delete the file
             print(f"Deleted file: {file_path}")
-        else:
-            print(f"File not found: {file_path}")
         return {
             "status": "success",
             "message": f"Text extracted and classified as {subject}",
@@ -131,190 +214,347 @@ def process_pdf_task(self, lesson_id, lesson_resource_id, file_path):
             "status": "error",
             "message": f"LessonResource with ID {lesson_resource_id} not found",
         }
+    except TRANSIENT_ERRORS as e:
+        logger.warning(f"⏳ Transient error in process_pdf_task, will retry: {e}")
+        retrying = self.request.retries < self.max_retries
+        raise
     except Exception as e:
         logger.exception(f"🔥 Unexpected error in process_pdf_task: {e}")
         return {"status": "error", "message": str(e)}
+    finally:
+        if not retrying:
+            release_job(quota_job)
+
+
+def classify_subject_with_llm(
+    extracted_persons, extracted_locations, extracted_topics, user_id=None
+):
+    """Asks Gemini to classify the subject from the extracted metadata, metering it to `user_id`."""
+    prompt = (
+        "Classifica l'argomento principale del testo tra le seguenti opzioni: "
+        f"{', '.join(SUBJECTS)}.\n\n"
+        "Ecco le informazioni chiave estratte:\n"
+        f"- **Persone citate**: {', '.join([p[0] for p in extracted_persons]) if extracted_persons else 'Nessuna'}\n"
+        f"- **Luoghi menzionati**: {', '.join([l[0] for l in extracted_locations]) if extracted_locations else 'Nessuno'}\n"
+        f"- **Temi principali**: {', '.join(extracted_topics) if extracted_topics else 'Non identificati'}\n\n"
+        "Rispondi solo con il nome della categoria in italiano, senza testo aggiuntivo."
+    )
+    # Call Google Gemini API
+    # A failed call raises instead of storing a made-up subject (e.g. quota exceeded)
+    response_data = generate_response_from_google(
+        prompt, raise_on_error=True, usage_user_id=user_id
+    )
+    subject = response_data["text"].strip() if response_data["text"] else "Altro"
+    input_tokens = response_data.get("input_tokens", 0)
+    output_tokens = response_data.get("output_tokens", 0)
+
+    logger.info(f"📊 Token usage - Input: {input_tokens}, Output: {output_tokens}")
+
+    return subject
+
+
+@shared_task
+def retrain_topic_model():
+    """Periodically retrains the corpus-level topic model (see CELERY_BEAT_SCHEDULE)."""
+    model_dir = train_topic_model()
+    return {"status": "success" if model_dir else "skipped", "model_dir": model_dir}
 
 
 @shared_task
+def retrain_subject_classifier():
+    """Periodically retrains the local subject classifier (see CELERY_BEAT_SCHEDULE)."""
+    model_path = train_subject_classifier()
+    return {"status": "success" if model_path else "skipped", "model_path": model_path}
+
+
+@shared_task
+def flush_api_usage():
+    """Adds the API usage buffered in Redis to MonthlyAPIUsage (see CELERY_BEAT_SCHEDULE)."""
+    return {"status": "success", "rows": flush_usage()}
+
+
+# Pages written to the database per round trip during extraction
+PAGE_SAVE_BATCH_SIZE = 16
+
+
+def extract_resource_pages(lesson_resource, pdf_path):
+    """
+    Extracts the PDF page by page into ResourcePage rows.
+    - Every page is stored with its text, character offsets and status
+    - Pages already marked as done (e.g. by a crashed run) are not extracted again:
+      extraction resumes from the first page that is not done
+    """
+    num_pages = count_pdf_pages(pdf_path)
+    ResourcePage.objects.bulk_create(
+        [
+            ResourcePage(resource=lesson_resource, page_number=page_number)
+            for page_number in range(num_pages)
+        ],
+        ignore_conflicts=True,
+    )
+
+    done_pages = set(
+        lesson_resource.pages.filter(status=ResourcePage.Status.DONE).values_list(
+            "page_number", flat=True
+        )
+    )
+    start_page = next(n for n in range(num_pages + 1) if n not in done_pages)
+    if start_page == num_pages:
+        return num_pages
+
+    if start_page:
+        logger.info(
+            f"⏩ Resuming LessonResource {lesson_resource.id} extraction from page {start_page}"
+        )
+        previous = lesson_resource.pages.get(page_number=start_page - 1)
+        char_start = previous.char_end + 1  # Pages are joined with a newline
+    else:
+        char_start = 0
+
+    batch = []
+    for page_number, text in iter_pdf_pages(pdf_path, start_page):
+        # PyPDF2 may return NUL characters, which PostgreSQL text columns reject
+        # (the rest of the cleanup needs the line breaks, see text_pipeline)
+        text = text.replace("\x00", "")
+        batch.append(
+            ResourcePage(
+                resource=lesson_resource,
+                page_number=page_number,
+                text=text,
+                char_start=char_start,
+                char_end=char_start + len(text),
+                status=ResourcePage.Status.DONE,
+            )
+        )
+        char_start += len(text) + 1
+        if len(batch) >= PAGE_SAVE_BATCH_SIZE:
+            _save_pages(batch)
+            batch = []
+    _save_pages(batch)
+
+    return num_pages
+
+
+def _save_pages(pages):
+    ResourcePage.objects.bulk_create(
+        pages,
+        update_conflicts=True,
+        unique_fields=["resource", "page_number"],
+        update_fields=["text", "char_start", "char_end", "status"],
+    )
+
+
+@shared_task(bind=True, **RETRY_POLICY)
 def analyze_lesson_resources(
-    lesson_id, resume_length, conceptual_map_size, key_concepts_count
+    self, lesson_id, resume_length, conceptual_map_size, key_concepts_count, quota_job=None
 ):
-    """AI function to analyze lesson resources and generate a summary and key concepts."""
+    """
+    AI function to analyze lesson resources and generate a summary and key concepts.
+    Each artifact (summary, key concepts, tables, timeline, people) is generated
+    concurrently by its own focused prompt and saved as soon as it is ready.
+    Lessons longer than ANALYSIS_CHUNK_CHARS are split at sentence boundaries and
+    each artifact is generated per chunk in parallel, then merged (map-reduce).
+    The lesson is marked analyzed by `finish_lesson_analysis` once all are done,
+    which also frees the user's job slot (`quota_job`, see app.quota); if the
+    analysis fails, `release_failed_job` frees it instead.
+    """
     try:
         # Retrieve the lesson
         lesson = Lesson.objects.get(id=lesson_id)
 
         # Retrieve all resources for the lesson
-        resources = LessonResource.objects.filter(lesson=lesson)
+        texts = [
+            text
+            for text in LessonResource.objects.filter(lesson=lesson).values_list(
+                "entry_text", flat=True
+            )
+            if text
+        ]
+        chunks = list(chunk_paragraphs(texts, settings.ANALYSIS_CHUNK_CHARS))
+        if not chunks:
+            release_job(quota_job)
+            return f"Error: Lesson {lesson_id} has no text to analyze."
 
-        # Combine all `entry_text` fields into a single large text
-        combined_text = " ".join(
-            resource.entry_text for resource in resources if resource.entry_text
+        artifacts = [
+            build_artifact_branch(
+                lesson_id, artifact, chunks, key_concepts_count, lesson.project.created_by_id
+            )
+            for artifact in ARTIFACTS
+        ]
+        chord(artifacts)(
+            finish_lesson_analysis.s(lesson_id, quota_job=quota_job).on_error(
+                release_failed_job.s(quota_job=quota_job)
+            )
         )
 
-            # Prepare the prompt for the Google Gemini API
-        prompt = (
-                f"Genera un riassunto dettagliato del seguente testo suddiviso in molti paragrafi. "
-                "Ogni paragrafo deve avere:\n"
-                "- Un ID numerico progressivo\n"
-                "- Un titolo breve e descrittivo\n"
-                "- Un riassunto dettagliato e completo per studiare \n\n"
-                f"Inoltre, identifica circa {key_concepts_count} concetti chiave del testo. Per ogni concetto, fornisci:\n"
-                "- Un titolo breve e descrittivo\n"
-                "- Una descrizione dettagliata\n"
-                "- Un livello di importanza da 1 a 5\n"
-                "- Sinonimi rilevanti\n"
-                "- Errori comuni o idee sbagliate associate al concetto\n\n"
-                "Inoltre, genera varie tabelle (se riesci) in formato JSON. Ogni tabella deve avere:\n"
-                "- Un titolo breve\n"
-                "- Dati della tabella in formato JSON (array di oggetti con colonne come 'id', 'prodotto', 'prezzo', ecc.)\n\n"
-                "Inoltre, fornisci un elenco delle principali tappe temporali (timeline) nel testo. Ogni evento nella timeline deve avere:\n"
-                "- Un titolo descrittivo dell'evento\n"
-                "- Una descrizione completa dell'evento\n"
-                "- Una data o periodo in formato numerico o stringa\n\n"
-                "Infine, identifica le persone più importanti menzionate nel testo. Per ciascuna persona fornisci:\n"
-                "- Il nome completo\n"
-                "- Una biografia \n\n"
-                "Restituisci la risposta in formato JSON con la seguente struttura:\n"
-                "{\n"
-                '  "summary": [\n'
-                "    {\n"
-                '      "id": 1,\n'
-                '      "title": "Titolo del paragrafo",\n'
-                '      "summary": "Riassunto del paragrafo"\n'
-                "    }\n"
-                "  ],\n"
-                '  "key_concepts": [\n'
-                "    {\n"
-                '      "id": 1,\n'
-                '      "title": "Titolo del concetto",\n'
-                '      "description": "Descrizione del concetto",\n'
-                '      "importance": 5,\n'
-                '      "synonyms": ["Sinonimo 1", "Sinonimo 2"],\n'
-                '      "misconceptions": ["Errore comune 1", "Errore comune 2"]\n'
-                "    }\n"
-                "  ],\n"
-                '  "tables": [\n'
-                "    {\n"
-                '      "title": "Tabella Prodotti",\n'
-                '      "data": [\n'
-                "        {\"id\": 201, \"prezzo\": 1200, \"prodotto\": \"Laptop\", \"disponibile\": \"Sì\"},\n"
-                "        {\"id\": 202, \"prezzo\": 800, \"prodotto\": \"Smartphone\", \"disponibile\": \"No\"}\n"
-                "      ]\n"
-                "    }\n"
-                "  ],\n"
-                '  "timeline": [\n'
-                "    {\n"
-                '      "title": "Battaglia di Azios",\n'
-                '      "description": "Ottaviano sconfigge Marco Antonio, fine delle guerre civili",\n'
-                '      "date": "32 a.C."\n'
-                "    }\n"
-                "  ]\n"
-                ' "people": [\n'
-                "    {\n"
-                '      "name": "Giulio Cesare",\n'
-                '      "bio": "Generale e politico romano, fu uno dei protagonisti della fine della Repubblica e l’inizio dell’Impero."\n'
-                "    }\n"
-                "  ]\n"
-                "}\n\n"
-                f"Testo:\n{combined_text}"
-            )
+        logger.info(
+            f"🧩 Analysis of lesson {lesson_id} started: {len(ARTIFACTS)} artifacts "
+            f"over {len(chunks)} chunks"
+        )
+        return f"Analysis of Lesson {lesson_id} started on {len(chunks)} chunks."
 
+    except TRANSIENT_ERRORS:
+        if self.request.retries >= self.max_retries:
+            release_job(quota_job)  # Giving up
+        raise
+    except Exception as e:
+        release_job(quota_job)
+        return f"Error: {e}"
 
 
-    # Call Google Gemini API to generate the summary and key concepts
-        response_data = generate_response_from_google(prompt)
+def build_artifact_branch(lesson_id, artifact, chunks, key_concepts_count, user_id):
+    """
+    Canvas of one artifact: generated over every chunk in parallel (map), then
+    merged and saved (reduce). The map tasks are built eagerly in a list: a
+    generator would only be read when the chord is applied, after the caller's
+    loop has moved on, and every branch would generate the last artifact.
+    """
+    count = key_concepts_count
+    if artifact == "key_concepts":
+        count = chunk_key_concepts_count(key_concepts_count, len(chunks))
+    return group(
+        [
+            generate_lesson_artifact.s(
+                lesson_id,
+                artifact,
+                index,
+                chunk,
+                count,
+                save_items=len(chunks) == 1,
+                user_id=user_id,
+            )
+            for index, chunk in enumerate(chunks)
+        ]
+    ) | save_lesson_artifact.s(lesson_id, artifact, key_concepts_count)
 
-        print("Raw response:", response_data)
 
-        # Clean the JSON response
-        cleaned_json = clean_json_response(response_data["text"])
-        print("Cleaned JSON:", cleaned_json)
+@shared_task(bind=True, max_retries=RETRY_POLICY["max_retries"], acks_late=True)
+def generate_lesson_artifact(
+    self, lesson_id, artifact, index, text, key_concepts_count, save_items=False, user_id=None
+):
+    """
+    Map step: generates one artifact of one chunk of a lesson. Transient errors
+    are retried with the RETRY_POLICY backoff; other errors (and exhausted retries)
+    are logged and return no items, so that one failed chunk does not discard the others.
+    Summary paragraphs and key concepts are streamed and parsed incrementally;
+    with `save_items` (single-chunk lessons, nothing to merge) each one is saved
+    as soon as it arrives instead of being returned. Usage is metered to `user_id`.
+    """
+    prompt = build_artifact_prompt(artifact, text, key_concepts_count)
+    generation_config = artifact_generation_config(artifact)
+    items, saved = [], 0
+    try:
+        if artifact not in STREAMED_ARTIFACTS:
+            response_data = generate_response_from_google(
+                prompt,
+                generation_config=generation_config,
+                raise_on_error=True,
+                usage_user_id=user_id,
+            )
+            items = parse_analysis_response(response_data["text"]).get(artifact, [])
+            return {"index": index, "items": items if isinstance(items, list) else []}
 
-        # Parse the cleaned JSON
-        response_json = json.loads(cleaned_json)
-        print("Parsed JSON:", response_json)
+        lesson = Lesson.objects.get(id=lesson_id)
+        user = get_analysis_user(lesson)
+        parser = StreamingArrayParser()
+        if save_items:
+            # Items saved by a previous attempt would be duplicated
+            clear_artifact(lesson, artifact)
 
-        # Extract the summary and key concepts
-        summary_text = response_json.get("summary", "Nessun riassunto generato.")
-        key_concepts_data = response_json.get("key_concepts", [])
-        tables_data = response_json.get("tables", [])
-        timeline_data = response_json.get("timeline", [])
-        mentioned_people = response_json.get("people", [])
+        def on_text(fragment):
+            nonlocal saved
+            for key, item in parser.feed(fragment):
+                if key != artifact:
+                    continue
+                if save_items:
+                    persist_artifact_item(lesson, artifact, item, user)
+                    saved += 1
+                else:
+                    items.append(item)
 
-        # Save the summary
-        User = get_user_model()  # Get the active user model dynamically
-        user = User.objects.get(pk=1)  # TBD - Replace with actual user
-        summary, created = Summary.objects.get_or_create(
-            lesson=lesson,
-            defaults={
-                "user": user,
-                "title": f"Summary for Lesson {lesson_id}",
-                "content": summary_text,  # Store the generated summary
-            },
+        generate_response_from_google(
+            prompt,
+            generation_config=generation_config,
+            on_text=on_text,
+            raise_on_error=True,
+            usage_user_id=user_id,
         )
-        summary.save()
-        
-        timeline, created = Timeline.objects.get_or_create(
-            lesson=lesson,
-            defaults={
-                "user": user,
-                "title": f" Timeline for Lesson {lesson_id}",
-                "data": timeline_data,  # Store the generated summary
-            },
-        )
-        timeline.save()
-    
-        # Save the key concepts
-        for concept_data in key_concepts_data:
-            KeyConcepts.objects.create(
-                user=user,
-                lesson=lesson,
-                data=concept_data,
-            )
-        # Save the tables
-        for table_data in tables_data:
-            Table.objects.create(
-                user=user,
-                title=table_data.get("title", "Untitled Table"),  # Handle cases where title might be missing
-                data=table_data.get("data", []),  # Default to empty list if no data is provided
-                lesson=lesson,
+        return {"index": index, "items": items, "saved": saved}
+    except TRANSIENT_ERRORS as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"⏳ {artifact} of chunk {index} of lesson {lesson_id} will be retried: {e}")
+            raise self.retry(
+                exc=e,
+                countdown=get_exponential_backoff_interval(
+                    factor=RETRY_POLICY["retry_backoff"],
+                    retries=self.request.retries,
+                    maximum=RETRY_POLICY["retry_backoff_max"],
+                    full_jitter=RETRY_POLICY["retry_jitter"],
+                ),
             )
-        for person_data in mentioned_people:
-            name = person_data.get("name")
-            bio = person_data.get("bio")  # se vuoi salvarla dopo
-
-            if name:
-                MentionedPerson.objects.create(
-                    user=user,
-                    lesson=lesson,
-                    name=name,
-                    bio=bio,
-                    image_url=None  # verrà popolato con Wikipedia nell'override di `save()`
-                )
-        # Mark lesson as analyzed
-        lesson.analyzed = True
-        lesson.save()
+        logger.error(f"❌ {artifact} of chunk {index} of lesson {lesson_id} failed: {e}")
+        return {"index": index, "items": None, "saved": saved}
+    except Exception as e:
+        logger.error(f"❌ {artifact} of chunk {index} of lesson {lesson_id} failed: {e}")
+        return {"index": index, "items": None, "saved": saved}
+
+
+@shared_task(**RETRY_POLICY)
+def save_lesson_artifact(results, lesson_id, artifact, key_concepts_count):
+    """Reduce step: merges the chunk results of one artifact and saves it right away."""
+    # A single chunk is not wrapped in a list by the canvas
+    if isinstance(results, dict):
+        results = [results]
+    saved = sum(result.get("saved", 0) for result in results)
+    if saved:
+        # Streamed items were already saved one by one by the map step
+        logger.info(f"✅ Saved {artifact} of lesson {lesson_id} ({saved} items, streamed)")
+        return {"artifact": artifact, "status": "success", "count": saved}
 
-        return f"Summary and key concepts for Lesson {lesson_id} created successfully."
+    results = sorted(results, key=lambda result: result["index"])
+    chunk_items = [result["items"] for result in results if result["items"] is not None]
+    if not chunk_items:
+        return {"artifact": artifact, "status": "error"}
 
+    try:
+        lesson = Lesson.objects.get(id=lesson_id)
+        items = merge_artifact(artifact, chunk_items, key_concepts_count)
+        if artifact == "people":
+            # Slow HTTP lookups: done before the rows are locked
+            fetch_people_images(items)
+        with transaction.atomic():
+            persist_artifact(lesson, artifact, items, get_analysis_user(lesson))
+    except TRANSIENT_ERRORS:
+        raise
     except Exception as e:
-        return f"Error: {e}"
+        logger.exception(f"🔥 Could not save {artifact} of lesson {lesson_id}: {e}")
+        return {"artifact": artifact, "status": "error"}
 
+    logger.info(f"✅ Saved {artifact} of lesson {lesson_id} ({len(items)} items)")
+    return {"artifact": artifact, "status": "success", "count": len(items)}
 
-def clean_json_response(text):
-    """
-    Extracts JSON from a Markdown code block (```json ... ```).
-    If no Markdown code block is found, returns the original text.
-    """
-    # Use regex to extract the JSON part from the Markdown code block
-    match = re.search(r"```json\s*({.*})\s*```", text, re.DOTALL)
-    if match:
-        try:
-            # Return the JSON part and strip any extra whitespace
-            return match.group(1).strip()
-        except (IndexError, AttributeError):
-            # If the regex match is invalid, fallback to the original text
-            return text
-    return text  # Fallback: return the original text if no Markdown is found
+
+@shared_task(**RETRY_POLICY)
+def finish_lesson_analysis(results, lesson_id, quota_job=None):
+    """Marks the lesson as analyzed once every artifact has been generated."""
+    release_job(quota_job)
+    saved = [result["artifact"] for result in results if result["status"] == "success"]
+    if not saved:
+        return f"Error: no artifact could be generated for Lesson {lesson_id}."
+
+    # Mark lesson as analyzed
+    Lesson.objects.filter(id=lesson_id).update(analyzed=True)
+    return f"Summary and key concepts for Lesson {lesson_id} created successfully ({', '.join(saved)})."
+
+
+@shared_task
+def release_failed_job(request, exc, traceback, quota_job=None):
+    """Error callback of the analysis chord: frees the user's job slot (see app.quota)."""
+    logger.error(f"❌ Lesson analysis failed: {exc}")
+    release_job(quota_job)
+
+
+def get_analysis_user(lesson):
+    """User the generated artifacts belong to."""
+    User = get_user_model()  # Get the active user model dynamically
+    return User.objects.get(pk=1)  # TBD - Replace with actual user
@@ -1,3 +1,246 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .analysis import (
+    ARTIFACTS,
+    StreamingArrayParser,
+    chunk_key_concepts_count,
+    parse_analysis_response,
+    repair_json,
+)
+
+
+class AnalysisTestCase(SimpleTestCase):
+    def setUp(self):
+        # Repairs are counted in Redis: not needed here
+        patcher = mock.patch("app.analysis.metrics.incr")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class RepairJsonTests(AnalysisTestCase):
+    def assertRepaired(self, text, expected):
+        self.assertEqual(json.loads(repair_json(text)), expected)
+
+    def test_valid_json_is_unchanged(self):
+        text = '{"summary": [{"id": 1, "title": "A, b"}], "ok": true}'
+        self.assertRepaired(text, json.loads(text))
+
+    def test_missing_comma_between_arrays(self):
+        self.assertRepaired(
+            '{"tables": [{"title": "T"}] "people": [{"name": "Dante"}]}',
+            {"tables": [{"title": "T"}], "people": [{"name": "Dante"}]},
+        )
+
+    def test_missing_comma_between_objects(self):
+        self.assertRepaired(
+            '{"people": [{"name": "Dante"}\n{"name": "Beatrice"}]}',
+            {"people": [{"name": "Dante"}, {"name": "Beatrice"}]},
+        )
+
+    def test_missing_comma_between_literals(self):
+        self.assertRepaired("[1 2 true null]", [1, 2, True, None])
+        self.assertRepaired('{"a": 1 "b": "x"}', {"a": 1, "b": "x"})
+
+    def test_trailing_commas(self):
+        self.assertRepaired(
+            '{"people": [{"name": "Dante",}, {"name": "Beatrice"},],}',
+            {"people": [{"name": "Dante"}, {"name": "Beatrice"}]},
+        )
+
+    def test_repeated_and_leading_commas(self):
+        self.assertRepaired("[,1,,2]", [1, 2])
+
+    def test_commas_and_brackets_inside_strings_are_kept(self):
+        self.assertRepaired(
+            '{"bio": "Poeta, [1265] {Firenze}"}', {"bio": "Poeta, [1265] {Firenze}"}
+        )
+
+    def test_raw_newline_inside_string(self):
+        self.assertRepaired('{"bio": "riga 1\nriga 2"}', {"bio": "riga 1\nriga 2"})
+
+    def test_truncated_string(self):
+        self.assertRepaired(
+            '{"people": [{"name": "Dante", "bio": "Poeta fiorent',
+            {"people": [{"name": "Dante", "bio": "Poeta fiorent"}]},
+        )
+
+    def test_truncated_after_escape(self):
+        self.assertRepaired('{"bio": "Il \\', {"bio": "Il "})
+
+    def test_truncated_dangling_key(self):
+        self.assertRepaired('{"name": "Dante", "bio"', {"name": "Dante", "bio": None})
+        self.assertRepaired('{"name": "Dante", "bio":', {"name": "Dante", "bio": None})
+
+    def test_truncated_after_comma(self):
+        self.assertRepaired('{"people": [{"name": "Dante"},', {"people": [{"name": "Dante"}]})
+
+    def test_text_before_the_json_is_dropped(self):
+        self.assertRepaired('Ecco il JSON: {"a": [1, 2]}', {"a": [1, 2]})
+
+    def test_unbalanced_closer_is_dropped(self):
+        self.assertRepaired('{"a": 1}}', {"a": 1})
+
+
+class ParseAnalysisResponseTests(AnalysisTestCase):
+    def test_markdown_code_block(self):
+        self.assertEqual(
+            parse_analysis_response('```json\n{"a": [1]}\n```'), {"a": [1]}
+        )
+
+    def test_backticks_inside_a_string_are_kept(self):
+        text = '{"timeline": [{"event": "Codice: ```print(1)```"}]}'
+        expected = {"timeline": [{"event": "Codice: ```print(1)```"}]}
+        self.assertEqual(parse_analysis_response(text), expected)
+        self.assertEqual(parse_analysis_response(f"```json\n{text}\n```"), expected)
+        self.assertEqual(parse_analysis_response(f"```json\n{text}```"), expected)
+        self.assertEqual(parse_analysis_response(f"```\n{text}"), expected)
+
+    def test_truncated_code_block_is_repaired(self):
+        self.assertEqual(
+            parse_analysis_response('```json\n{"people": [{"name": "Dante"'),
+            {"people": [{"name": "Dante"}]},
+        )
+
+
+class StreamingArrayParserTests(AnalysisTestCase):
+    RESPONSE = (
+        '```json\n{"summary": [{"id": 1, "title": "Intro {1}", "text": "a \\"b\\""}, '
+        '{"id": 2, "title": "Fine", "items": [{"x": 1}]}], '
+        '"key_concepts": [{"title": "Concetto"}]}\n```'
+    )
+    EXPECTED = [
+        ("summary", {"id": 1, "title": "Intro {1}", "text": 'a "b"'}),
+        ("summary", {"id": 2, "title": "Fine", "items": [{"x": 1}]}),
+        ("key_concepts", {"title": "Concetto"}),
+    ]
+
+    def feed_fragments(self, fragments):
+        parser = StreamingArrayParser()
+        items = []
+        for fragment in fragments:
+            items.extend(parser.feed(fragment))
+        return items
+
+    def test_whole_response(self):
+        self.assertEqual(self.feed_fragments([self.RESPONSE]), self.EXPECTED)
+
+    def test_every_split_point(self):
+        for split in range(len(self.RESPONSE) + 1):
+            with self.subTest(split=split):
+                self.assertEqual(
+                    self.feed_fragments([self.RESPONSE[:split], self.RESPONSE[split:]]),
+                    self.EXPECTED,
+                )
+
+    def test_one_character_at_a_time(self):
+        self.assertEqual(self.feed_fragments(list(self.RESPONSE)), self.EXPECTED)
+
+    def test_items_are_returned_as_soon_as_complete(self):
+        parser = StreamingArrayParser()
+        self.assertEqual(parser.feed('{"summary": [{"id": 1}, {"id"'), [("summary", {"id": 1})])
+        self.assertEqual(parser.feed(": 2}]}"), [("summary", {"id": 2})])
+
+    def test_malformed_item_is_repaired(self):
+        self.assertEqual(
+            self.feed_fragments(['{"people": [{"name": "Dante",}, {"name": "Bea" "bio": "x"}]}']),
+            [("people", {"name": "Dante"}), ("people", {"name": "Bea", "bio": "x"})],
+        )
+
+    def test_incomplete_item_is_not_returned(self):
+        self.assertEqual(self.feed_fragments(['{"summary": [{"id": 1}, {"id": 2']), [("summary", {"id": 1})])
+
+
+class AnalysisCanvasTests(SimpleTestCase):
+    @mock.patch("app.tasks.chord")
+    @mock.patch("app.tasks.LessonResource")
+    @mock.patch("app.tasks.Lesson")
+    def test_every_branch_generates_its_own_artifact(self, lesson_model, resource_model, chord):
+        from .tasks import analyze_lesson_resources
+        from .utils import chunk_paragraphs
+
+        lesson_model.objects.get.return_value.project.created_by_id = 7
+        texts = ["primo blocco", "secondo blocco"]
+        resource_model.objects.filter.return_value.values_list.return_value = texts
+        with self.settings(ANALYSIS_CHUNK_CHARS=len(texts[0])):
+            analyze_lesson_resources.run(1, None, None, 10)
+            chunks = list(chunk_paragraphs(texts, len(texts[0])))
+        self.assertGreater(len(chunks), 1)
+
+        branches = chord.call_args.args[0]
+        self.assertEqual(len(branches), len(ARTIFACTS))
+        for artifact, branch in zip(ARTIFACTS, branches):
+            with self.subTest(artifact=artifact):
+                count = (
+                    chunk_key_concepts_count(10, len(chunks))
+                    if artifact == "key_concepts"
+                    else 10
+                )
+                self.assertEqual(
+                    [task.args for task in branch.tasks],
+                    [(1, artifact, index, chunk, count) for index, chunk in enumerate(chunks)],
+                )
+                self.assertEqual(
+                    [task.kwargs for task in branch.tasks],
+                    [{"save_items": False, "user_id": 7}] * len(chunks),
+                )
+                self.assertEqual(branch.body.args, (1, artifact, 10))
+
+
+class FakeDoc(list):
+    """Tokens of a segment, with one PER and one LOC entity."""
+
+    ents = [
+        SimpleNamespace(label_="PER", text="Dante"),
+        SimpleNamespace(label_="LOC", text="Firenze"),
+    ]
+
+
+class FakeNlp:
+    """Stands in for spaCy: every word is a noun, lemmatised with the pid of its process."""
+
+    pipe_names = []
+
+    def pipe(self, texts, batch_size=None, disable=None):
+        for text in texts:
+            yield FakeDoc(
+                SimpleNamespace(pos_="NOUN", text=word, lower_=word, lemma_=f"{word}-{os.getpid()}")
+                for word in text.split()
+            )
+
+
+def _run_text_analysis(segments, results):
+    from .utils import TextAnalysis
+
+    analysis = TextAnalysis(segments, n_process=2)
+    results.put(
+        (os.getpid(), analysis.person_counter, analysis.location_counter, analysis.noun_tokens)
+    )
+
+
+@mock.patch("app.utils.get_stop_words", return_value=set())
+@mock.patch("app.utils.get_nlp", return_value=FakeNlp())
+class TextAnalysisProcessTests(SimpleTestCase):
+    SEGMENTS = [f"parola{index} altra{index}" for index in range(6)]
+
+    def test_segments_are_analysed_by_workers_from_a_daemonic_process(self, get_nlp, get_stop_words):
+        # Celery's prefork children are daemonic
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        worker = context.Process(target=_run_text_analysis, args=(self.SEGMENTS, results), daemon=True)
+        worker.start()
+        worker_pid, persons, locations, noun_tokens = results.get(timeout=60)
+        worker.join()
+
+        self.assertEqual(persons, Counter({"Dante": len(self.SEGMENTS)}))
+        self.assertEqual(locations, Counter({"Firenze": len(self.SEGMENTS)}))
+        words = [word for segment in self.SEGMENTS for word in segment.split()]
+        self.assertEqual([token.rsplit("-", 1)[0] for token in noun_tokens], words)
+        pids = {int(token.rsplit("-", 1)[1]) for token in noun_tokens}
+        self.assertNotIn(worker_pid, pids)  # Not the serial fallback
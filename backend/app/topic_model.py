@@ -0,0 +1,143 @@
+import logging
+import os
+import shutil
+import time
+from django.conf import settings
+
+from .utils import TextAnalysis, extract_topics_lda
+
+logger = logging.getLogger(__name__)
+
+# File pointing to the directory of the current model (swapped atomically)
+CURRENT_POINTER = "CURRENT"
+MODEL_FILENAME = "lda.model"
+MODEL_DIR_PREFIX = "lda-"
+# Model versions kept on disk: the current one and the previous one, which
+# workers that have not reloaded yet may still be opening
+KEEP_VERSIONS = 2
+
+# Process-wide cache of the loaded model: {"version": str, "model": LdaModel}
+_loaded = {"version": None, "model": None}
+
+
+def train_topic_model():
+    """
+    Trains an LDA model over the `entry_text` of every stored LessonResource and
+    saves it under settings.NLP_MODEL_DIR. Returns the model directory, or None
+    when the corpus is still too small to train anything meaningful.
+    """
+    from gensim import corpora
+    from gensim.models import LdaModel
+    from .models import LessonResource
+
+    texts = (
+        LessonResource.objects.exclude(entry_text="")
+        .values_list("entry_text", flat=True)
+        .iterator(chunk_size=20)
+    )
+    documents = [TextAnalysis(text, profile="lemma").noun_tokens for text in texts]
+    documents = [tokens for tokens in documents if tokens]
+
+    if len(documents) < settings.TOPIC_MODEL_MIN_DOCUMENTS:
+        logger.info(
+            f"📚 Topic model not trained: {len(documents)} documents "
+            f"(minimum {settings.TOPIC_MODEL_MIN_DOCUMENTS})"
+        )
+        return None
+
+    dictionary = corpora.Dictionary(documents)
+    # Drop words that appear in a single document or in most of them
+    dictionary.filter_extremes(no_below=2, no_above=0.5, keep_n=50_000)
+    corpus = [dictionary.doc2bow(tokens) for tokens in documents]
+
+    lda_model = LdaModel(
+        corpus,
+        num_topics=settings.TOPIC_MODEL_NUM_TOPICS,
+        id2word=dictionary,
+        passes=10,
+        alpha="auto",
+        eta="auto",
+    )
+
+    # Save in a new versioned directory, then atomically point CURRENT at it so
+    # that workers never load a half-written model
+    version = time.strftime("%Y%m%d%H%M%S")
+    model_dir = os.path.join(settings.NLP_MODEL_DIR, f"{MODEL_DIR_PREFIX}{version}")
+    os.makedirs(model_dir, exist_ok=True)
+    lda_model.save(os.path.join(model_dir, MODEL_FILENAME))
+
+    pointer_path = os.path.join(settings.NLP_MODEL_DIR, CURRENT_POINTER)
+    tmp_pointer_path = f"{pointer_path}.{os.getpid()}.tmp"
+    with open(tmp_pointer_path, "w") as pointer:
+        pointer.write(os.path.basename(model_dir))
+    os.replace(tmp_pointer_path, pointer_path)
+    prune_topic_models()
+
+    logger.info(f"📚 Topic model trained on {len(documents)} documents: {model_dir}")
+    return model_dir
+
+
+def prune_topic_models():
+    """
+    Deletes the model versions older than the last KEEP_VERSIONS. Workers still
+    mapping a deleted model keep reading it until they reload (the files are
+    only freed once closed).
+    """
+    versions = sorted(
+        name
+        for name in os.listdir(settings.NLP_MODEL_DIR)
+        if name.startswith(MODEL_DIR_PREFIX)
+        and os.path.isdir(os.path.join(settings.NLP_MODEL_DIR, name))
+    )
+    for name in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(settings.NLP_MODEL_DIR, name), ignore_errors=True)
+        logger.info(f"📚 Deleted old topic model {name}")
+
+
+def load_topic_model():
+    """
+    Returns the current pretrained LdaModel, loading it on first use and
+    reloading it when a newer one has been trained. None if none exists yet.
+    """
+    pointer_path = os.path.join(settings.NLP_MODEL_DIR, CURRENT_POINTER)
+    try:
+        with open(pointer_path) as pointer:
+            version = pointer.read().strip()
+    except FileNotFoundError:
+        return None
+
+    if version != _loaded["version"]:
+        from gensim.models import LdaModel
+
+        model_path = os.path.join(settings.NLP_MODEL_DIR, version, MODEL_FILENAME)
+        # mmap: the large topic matrices are shared read-only between processes
+        _loaded["model"] = LdaModel.load(model_path, mmap="r")
+        _loaded["version"] = version
+        logger.info(f"📚 Loaded topic model {version}")
+
+    return _loaded["model"]
+
+
+def infer_topics(tokens, num_topics=1, num_words=6):
+    """
+    Returns the `num_topics` most likely topics of a document (same format as
+    `extract_topics_lda`) by inference on the pretrained model. Until a model
+    has been trained, falls back to training a per-document LDA.
+    """
+    lda_model = load_topic_model()
+    if lda_model is None:
+        return extract_topics_lda(
+            None, num_topics=num_topics, num_words=num_words, tokens=tokens
+        )
+
+    bow = lda_model.id2word.doc2bow(tokens)
+    if not bow:
+        return []
+
+    document_topics = sorted(
+        lda_model.get_document_topics(bow), key=lambda x: x[1], reverse=True
+    )
+    return [
+        lda_model.print_topic(topic_id, topn=num_words)
+        for topic_id, _ in document_topics[:num_topics]
+    ]
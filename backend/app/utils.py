@@ -1,37 +1,146 @@
+import io
 import os
 import re
+import logging
 import unicodedata
-import spacy
-import gensim
 import heapq
-import nltk
-from nltk.corpus import stopwords
-from gensim import corpora
-from collections import Counter
+import multiprocessing
+from collections import Counter, defaultdict
+from functools import cached_property, lru_cache
+from decouple import config
 from PyPDF2 import PdfReader
+from .nlp import get_nlp, get_stop_words
 
-# Load spaCy Italian NLP model
-nlp = spacy.load("it_core_news_sm")
+logger = logging.getLogger(__name__)
 
-# Ensure stopwords are downloaded
-nltk.download("stopwords")
-stop_words = set(stopwords.words("italian"))
+# spaCy components each extraction needs: the others (e.g. the dependency
+# parser, the most expensive one) are disabled while processing
+PIPELINE_PROFILES = {
+    "ner": {"tok2vec", "ner"},
+    "lemma": {"tok2vec", "morphologizer", "tagger", "attribute_ruler", "lemmatizer"},
+}
+# Persons, locations and noun lemmas in a single pass (still without the parser)
+PIPELINE_PROFILES["analysis"] = PIPELINE_PROFILES["ner"] | PIPELINE_PROFILES["lemma"]
+
+# Texts per batch when several segments are processed with nlp.pipe
+NLP_BATCH_SIZE = config("NLP_BATCH_SIZE", default=16, cast=int)
+# Processes analysing the segments of multi-segment documents (1 = in process)
+NLP_PROCESSES = config("NLP_PROCESSES", default=1, cast=int)
+
+
+# Parallel PDF extraction: number of worker processes and minimum page count
+# below which the pool start-up cost is not worth paying
+PDF_EXTRACTION_WORKERS = config(
+    "PDF_EXTRACTION_WORKERS", default=os.cpu_count() or 1, cast=int
+)
+PDF_PARALLEL_MIN_PAGES = config("PDF_PARALLEL_MIN_PAGES", default=40, cast=int)
 
 
 ### --- TEXT EXTRACTION FUNCTIONS --- ###
 
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a PDF file."""
+def extract_text_from_pdf(pdf_path, workers=None, min_pages=None):
+    """Extracts text from a PDF file (path or binary file object)."""
     try:
-        reader = PdfReader(pdf_path)
-        pages_text = [page.extract_text() or "" for page in reader.pages]
+        pages_text = extract_pages_from_pdf(pdf_path, workers, min_pages)
         full_text = "\n".join(pages_text)
         return full_text
     except Exception as e:
         return f"Error extracting text: {str(e)}"
 
 
+def extract_pages_from_pdf(pdf_path, workers=None, min_pages=None):
+    """Extracts the text of every page of a PDF, in page order."""
+    return [text for _, text in iter_pdf_pages(pdf_path, 0, workers, min_pages)]
+
+
+def iter_pdf_pages(pdf_path, start_page=0, workers=None, min_pages=None):
+    """
+    Yields (page_number, text) for every page from `start_page` on, in page order.
+    - Large files are split in contiguous page batches extracted by a process pool
+    - Small files (or a single worker) are extracted serially
+    - Pages are yielded as soon as their batch is ready, so callers can persist
+      progress and resume from the first missing page
+    """
+    workers = PDF_EXTRACTION_WORKERS if workers is None else workers
+    min_pages = PDF_PARALLEL_MIN_PAGES if min_pages is None else min_pages
+
+    # Worker processes need something picklable: a path or the raw bytes
+    source = pdf_path if isinstance(pdf_path, (str, os.PathLike)) else pdf_path.read()
+    reader = PdfReader(_open_pdf_source(source))
+    num_pages = len(reader.pages)
+    workers = min(workers, num_pages - start_page)
+    next_page = start_page
+
+    if workers > 1 and num_pages - start_page >= min_pages:
+        batches = split_page_ranges(start_page, num_pages, workers)
+        try:
+            with _process_pool(workers) as pool:
+                results = pool.imap(
+                    _extract_page_batch,
+                    [(source, start, stop) for start, stop in batches],
+                )
+                # imap() yields in submission order, so the pages come back in order
+                for chunk in results:
+                    for text in chunk:
+                        yield next_page, text
+                        next_page += 1
+        except (AssertionError, OSError) as e:
+            # e.g. no process can be forked (resource limits)
+            logger.warning(
+                f"Parallel PDF extraction unavailable ({e}), falling back to serial"
+            )
+
+    for page_number in range(next_page, num_pages):
+        yield page_number, reader.pages[page_number].extract_text() or ""
+
+
+def count_pdf_pages(pdf_path):
+    """Returns the number of pages of a PDF."""
+    return len(PdfReader(pdf_path).pages)
+
+
+# Pages per batch sent to a worker: small enough to report progress often
+PDF_PAGE_BATCH_SIZE = 16
+
+
+def split_page_ranges(start_page, num_pages, workers):
+    """
+    Splits [start_page, num_pages) in contiguous (start, stop) batches, at most
+    PDF_PAGE_BATCH_SIZE pages each and evenly spread over `workers`.
+    """
+    remaining = num_pages - start_page
+    size = max(1, min(PDF_PAGE_BATCH_SIZE, -(-remaining // workers)))
+    return [
+        (start, min(start + size, num_pages))
+        for start in range(start_page, num_pages, size)
+    ]
+
+
+def _open_pdf_source(source):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _process_pool(workers):
+    """
+    Returns a process pool, usable from a Celery prefork worker too: its
+    children are daemonic, and multiprocessing refuses to start processes
+    from a daemonic one, while billiard (Celery's fork of it) does not.
+    """
+    if multiprocessing.current_process().daemon:
+        from billiard.pool import Pool  # Installed with Celery
+
+        return Pool(processes=workers)
+    return multiprocessing.Pool(processes=workers)
+
+
+def _extract_page_batch(batch):
+    """Runs in a worker process: extracts pages [start, stop) of the PDF."""
+    source, start, stop = batch
+    reader = PdfReader(_open_pdf_source(source))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
 def basic_cleaning(text):
     """
     Cleans the extracted text by:
@@ -40,19 +149,51 @@ def basic_cleaning(text):
     - Removing control characters
     - Normalizing spaces
     """
-    # Replace corrupt Unicode characters (often shown as "�" or similar)
-    text = text.replace("\ufffd", "")  # Remove replacement character (�)
+    return normalize_text(text)
 
-    # Remove unwanted special characters like ●, long dashes, etc.
-    text = re.sub(r"[●�]+", "", text)
 
-    # Remove excessive whitespace
-    text = re.sub(r"\s+", " ", text).strip()
+@lru_cache(maxsize=None)
+def _bmp_control_chars_re():
+    """
+    Regex matching runs of Basic Multilingual Plane characters of Unicode
+    category 'C' (control, format, surrogate, private use, unassigned).
+    Restricting the class to the BMP lets `re` compile it into a lookup table,
+    so non-matching characters are rejected in constant time.
+    """
+    ranges = []
+    start = None
+    for codepoint in range(0x10001):
+        is_control = codepoint < 0x10000 and unicodedata.category(chr(codepoint))[0] == "C"
+        if is_control and start is None:
+            start = codepoint
+        elif not is_control and start is not None:
+            ranges.append(f"\\u{start:04x}-\\u{codepoint - 1:04x}")
+            start = None
+    return re.compile(f"[{''.join(ranges)}]+")
 
-    # Remove hidden control characters
-    text = remove_control_chars(text)
 
-    return text
+# Characters outside the BMP are rare in extracted text: they are checked one by one
+_ASTRAL_CHAR_RE = re.compile("[\U00010000-\U0010ffff]")
+
+
+def _drop_control_char(match):
+    char = match.group()
+    return "" if unicodedata.category(char)[0] == "C" else char
+
+
+def normalize_text(text):
+    """
+    Fused equivalent of the original cleaning chain, byte-identical to it:
+    - Removes replacement characters (�) and symbols like ●
+    - Collapses whitespace runs into single spaces and strips the ends
+    - Removes control characters (after collapsing, as before, so the spacing
+      around them is preserved exactly)
+    Every step is a C-level string operation: no per-character Python loop.
+    """
+    text = text.replace("\ufffd", "").replace("●", "")
+    # str.split() splits on the same whitespace as re's \s and drops the ends
+    text = " ".join(text.split())
+    return remove_control_chars(text)
 
 
 def smart_line_joining(text: str) -> str:
@@ -98,24 +239,157 @@ def remove_control_chars(text):
     """
     Removes control characters (Unicode category 'C') that cause encoding issues.
     """
-    return "".join(ch for ch in text if unicodedata.category(ch)[0] != "C")
+    text = _bmp_control_chars_re().sub("", text)
+    if _ASTRAL_CHAR_RE.search(text):
+        text = _ASTRAL_CHAR_RE.sub(_drop_control_char, text)
+    return text
+
+
+### --- STREAMING INGESTION PIPELINE --- ###
+# pages -> lines -> cleaned lines -> joined paragraphs -> bounded chunks
+# Every stage is a generator, so only the current page/paragraph/chunk is in memory.
+
+# Maximum size of the chunks produced by the pipeline
+TEXT_CHUNK_CHARS = config("TEXT_CHUNK_CHARS", default=100_000, cast=int)
 
+_LINE_END_PUNCTUATION_RE = re.compile(r"[.!?;:]$")
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?;:])\s+")
 
 
+def iter_lines(pages):
+    """Splits each page text into its lines, keeping the line structure."""
+    for page in pages:
+        yield from page.splitlines()
+
+
+def clean_lines(lines):
+    """Normalizes each line (see `normalize_text`) and drops the empty ones."""
+    for line in lines:
+        line = normalize_text(line)
+        if line:
+            yield line
+
+
+def join_lines(lines):
+    """
+    Streaming version of `smart_line_joining`: a line that does not end with
+    punctuation and is followed by a lowercase line is the same paragraph.
+    Yields one paragraph at a time.
+    """
+    paragraph = []
+    previous = None
+    for line in lines:
+        if previous is not None:
+            paragraph.append(previous)
+            if _LINE_END_PUNCTUATION_RE.search(previous) or not line[0].islower():
+                yield " ".join(paragraph)
+                paragraph = []
+        previous = line
+    if previous is not None:
+        paragraph.append(previous)
+        yield " ".join(paragraph)
+
+
+def chunk_paragraphs(paragraphs, max_chars=None):
+    """
+    Groups paragraphs into chunks of at most `max_chars` characters.
+    Paragraphs that are too long on their own are split at sentence
+    boundaries (or, as a last resort, at spaces).
+    """
+    max_chars = max_chars or TEXT_CHUNK_CHARS
+    buffer = []
+    size = 0
+    for paragraph in paragraphs:
+        for piece in _split_long_text(paragraph, max_chars):
+            if buffer and size + len(piece) + 1 > max_chars:
+                yield " ".join(buffer)
+                buffer = []
+                size = 0
+            buffer.append(piece)
+            size += len(piece) + 1
+    if buffer:
+        yield " ".join(buffer)
+
+
+def _split_long_text(text, max_chars):
+    if len(text) <= max_chars:
+        yield text
+        return
+    for sentence in _SENTENCE_BOUNDARY_RE.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            yield sentence
+
+
+def text_pipeline(pages, max_chars=None):
+    """
+    Composes the streaming stages: yields the cleaned, line-joined text of the
+    pages as chunks of at most `max_chars` characters, split at paragraph or
+    sentence boundaries. `" ".join(chunks)` is the document's `entry_text`.
+    """
+    return chunk_paragraphs(join_lines(clean_lines(iter_lines(pages))), max_chars)
+
+
+### --- NLP FUNCTIONS --- ###
+
+
+def disabled_components(profile):
+    """Names of the pipeline components not needed by a PIPELINE_PROFILES entry."""
+    keep = PIPELINE_PROFILES[profile]
+    return [name for name in get_nlp().pipe_names if name not in keep]
+
+
+def parse(text, profile):
+    """Runs spaCy on a text with only the components of `profile` enabled."""
+    return get_nlp()(text, disable=disabled_components(profile))
+
+
+def parse_segments(segments, profile, batch_size=None):
+    """Lazily yields the Docs of several text segments, processed in batches."""
+    return get_nlp().pipe(
+        segments,
+        batch_size=batch_size or NLP_BATCH_SIZE,
+        disable=disabled_components(profile),
+    )
+
+
+def split_for_nlp(text, max_chars=None):
+    """
+    Splits a (possibly longer than `nlp.max_length`) text into segments of at
+    most `max_chars` characters, at paragraph or sentence boundaries, so that
+    entities are never cut in half.
+    """
+    max_chars = min(max_chars or TEXT_CHUNK_CHARS, get_nlp().max_length)
+    lines = (line for line in text.splitlines() if line.strip())
+    return list(chunk_paragraphs(lines, max_chars))
+
 
 def extract_persons_by_frequency(text):
     """
     Extracts persons and sorts them by frequency of appearance, merging similar names.
     """
-    doc = nlp(text)
-    person_counter = Counter()
+    return TextAnalysis(text, profile="ner").persons
+
 
+def count_persons(doc, person_counter):
+    """Adds the cleaned PER entities of a Doc to `person_counter`."""
     for ent in doc.ents:
         if ent.label_ == "PER":  # If it's a person
             cleaned_name = clean_name(ent.text)  # Apply cleaning
             if cleaned_name:
                 person_counter[cleaned_name] += 1
 
+    return person_counter
+
+
+def sort_persons(person_counter):
+    """
+    Merges similar names and sorts them by most mentioned first.
+    """
     # Merge similar names
     merged_persons = merge_similar_names(person_counter)
 
@@ -161,16 +435,24 @@ def extract_locations(text):
     """
     Extracts locations from text and sorts them by frequency of appearance.
     """
-    doc = nlp(text)
-    location_counter = Counter()
+    return TextAnalysis(text, profile="ner").locations
+
 
+def count_locations(doc, location_counter):
+    """Adds the cleaned LOC/GPE entities of a Doc to `location_counter`."""
     for ent in doc.ents:
         if ent.label_ in ["LOC", "GPE"]:  # LOC = geographic place, GPE = city/country
             cleaned_location = clean_location(ent.text)  # Apply cleaning
             if cleaned_location:
                 location_counter[cleaned_location] += 1
 
-    # Sort by most mentioned first
+    return location_counter
+
+
+def sort_locations(location_counter):
+    """
+    Sorts locations by most mentioned first.
+    """
     sorted_locations = sorted(
         location_counter.items(), key=lambda x: x[1], reverse=True
     )
@@ -178,45 +460,78 @@ def extract_locations(text):
     return sorted_locations  # Returns list of tuples (location, count)
 
 
-
-
 def merge_similar_names(person_counts):
     """
     Merges similar names by grouping shorter names into longer ones.
     - Example: ('Augusto', 15) and ('Ottaviano Augusto', 3) → ('Ottaviano Augusto', 18)
+    - Names are visited from the longest: each one is merged into the first kept
+      name that contains it, otherwise it is kept
+    - Candidates are looked up in a character-trigram index of the kept names
+      (only names containing the rarest trigram of the name can contain it),
+      so the merge is near-linear instead of comparing every pair of names
     """
     sorted_names = sorted(person_counts.items(), key=lambda x: len(x[0]), reverse=True)
     merged_counts = {}
+    kept_names = []  # Same order as merged_counts
+    trigram_index = defaultdict(list)  # Trigram -> positions in kept_names (ascending)
+
+    for name, count in sorted_names:
+        container = _find_containing_name(name, kept_names, trigram_index)
+        if container is not None:
+            # If one name is part of another, merge the counts into the longer name
+            merged_counts[container] += count
+            continue
+
+        position = len(kept_names)
+        kept_names.append(name)
+        merged_counts[name] = count
+        for trigram in _trigrams(name):
+            trigram_index[trigram].append(position)
 
-    for longer_name, count in sorted_names:
-        merged = False
+    return merged_counts
 
-        for existing_name in list(merged_counts.keys()):
-            if longer_name in existing_name or existing_name in longer_name:
-                # If one name is part of another, merge the counts into the longer name
-                merged_counts[existing_name] += count
-                merged = True
-                break
 
-        if not merged:
-            merged_counts[longer_name] = count
+def _trigrams(name):
+    return {name[i : i + 3] for i in range(len(name) - 2)}
 
-    return merged_counts
 
-def extract_topics_lda(text, num_topics=1, num_words=6):
+def _find_containing_name(name, kept_names, trigram_index):
+    """Returns the first kept name (in insertion order) containing `name`, if any."""
+    if len(name) < 3:
+        # Too short to be indexed: rare enough for a linear scan
+        return next((kept for kept in kept_names if name in kept), None)
+
+    postings = []
+    for trigram in _trigrams(name):
+        positions = trigram_index.get(trigram)
+        if not positions:
+            return None  # No kept name contains this trigram
+        postings.append(positions)
+
+    for position in min(postings, key=len):
+        if name in kept_names[position]:
+            return kept_names[position]
+    return None
+
+
+def extract_topics_lda(text, num_topics=1, num_words=6, tokens=None):
     """
     Uses LDA to extract topics from the text.
     - Returns top N topics with top words per topic.
+    - Pass `tokens` (e.g. `TextAnalysis.noun_tokens`) to skip re-parsing the text.
     """
     # Preprocess the text
-    tokens = preprocess_text(text)
+    if tokens is None:
+        tokens = preprocess_text(text)
+
+    from gensim import corpora, models  # Heavy: only imported by the workers
 
     # Create dictionary and corpus for LDA
     dictionary = corpora.Dictionary([tokens])
     corpus = [dictionary.doc2bow(tokens)]  # Bag of Words format
 
     # Train the LDA model with better hyperparameters
-    lda_model = gensim.models.LdaModel(
+    lda_model = models.LdaModel(
         corpus,
         num_topics=num_topics,
         id2word=dictionary,
@@ -240,19 +555,115 @@ def preprocess_text(text):
     - Keeps only meaningful nouns & proper nouns
     - Removes overly frequent terms like 'città' or 'd.c.'
     """
-    doc = nlp(text.lower())  # Convert to lowercase
+    # Convert to lowercase
+    return TextAnalysis(text.lower(), profile="lemma").noun_tokens
 
-    # Common words that are not stopwords but still too generic for topics
-    additional_stopwords = {"città", "secolo", "d.c", "a.c", "storia", "anni", "regno"}
 
+# Common words that are not stopwords but still too generic for topics
+ADDITIONAL_STOPWORDS = {"città", "secolo", "d.c", "a.c", "storia", "anni", "regno"}
+
+
+def noun_tokens_from_doc(doc):
+    """
+    Returns the lowercased lemmas of the meaningful nouns & proper nouns of a Doc.
+    """
+    stop_words = get_stop_words()
     tokens = [
-        token.lemma_  # Use lemma (root form)
+        token.lemma_.lower()  # Use lemma (root form)
         for token in doc
         if token.pos_ in ["NOUN", "PROPN"]  # Keep only nouns & proper nouns
-        and token.text not in stop_words  # Remove generic stopwords
-        and token.text
-        not in additional_stopwords  # Remove domain-specific frequent words
+        and token.lower_ not in stop_words  # Remove generic stopwords
+        and token.lower_
+        not in ADDITIONAL_STOPWORDS  # Remove domain-specific frequent words
         and len(token.text) > 2  # Ensure word has meaningful length
     ]
 
     return tokens
+
+
+def _analyze_segments(batch):
+    """
+    Runs in a worker process too: returns the person and location counts and
+    the noun tokens of a list of segments, for the components of `profile`.
+    """
+    segments, profile = batch
+    components = PIPELINE_PROFILES[profile]
+    persons, locations, noun_tokens = Counter(), Counter(), []
+    for doc in parse_segments(segments, profile):
+        if "ner" in components:
+            count_persons(doc, persons)
+            count_locations(doc, locations)
+        if "lemmatizer" in components:
+            noun_tokens.extend(noun_tokens_from_doc(doc))
+    return persons, locations, noun_tokens
+
+
+class TextAnalysis:
+    """
+    Runs spaCy once over a text (or its segments) and exposes every extraction:
+    - persons (merged and sorted by frequency)
+    - locations (sorted by frequency)
+    - noun tokens used for topic modeling
+    Segments are processed in batches with `nlp.pipe` using only the components
+    of `profile` and discarded once counted, so memory stays bounded. Texts
+    longer than a segment are split first (see `split_for_nlp`): counts are
+    summed across segments before merging names, as for a single Doc.
+    With `n_process` > 1, contiguous batches of segments are analysed by a
+    process pool (see `_process_pool`, which also works inside Celery workers).
+    """
+
+    def __init__(self, text_or_segments, profile="analysis", n_process=None):
+        segments = (
+            split_for_nlp(text_or_segments)
+            if isinstance(text_or_segments, str)
+            else list(text_or_segments)
+        )
+        n_process = NLP_PROCESSES if n_process is None else n_process
+        n_process = max(1, min(n_process, len(segments)))
+        self.person_counter = Counter()
+        self.location_counter = Counter()
+        self.noun_tokens = []
+
+        if n_process > 1:
+            try:
+                self._process_parallel(segments, profile, n_process)
+                return
+            except (AssertionError, OSError) as e:
+                # e.g. no process can be forked (resource limits)
+                logger.warning(f"Multiprocess NLP unavailable ({e}), falling back to serial")
+                self.person_counter = Counter()
+                self.location_counter = Counter()
+                self.noun_tokens = []
+        self._add(_analyze_segments((segments, profile)))
+
+    def _process_parallel(self, segments, profile, n_process):
+        # Loaded before forking, so that the workers share the parent's copy
+        get_nlp()
+        get_stop_words()
+        batches = [
+            (segments[start:stop], profile)
+            for start, stop in split_page_ranges(0, len(segments), n_process)
+        ]
+        with _process_pool(n_process) as pool:
+            # imap() yields in submission order: the noun tokens keep the text order
+            for result in pool.imap(_analyze_segments, batches):
+                self._add(result)
+
+    def _add(self, result):
+        persons, locations, noun_tokens = result
+        self.person_counter.update(persons)
+        self.location_counter.update(locations)
+        self.noun_tokens.extend(noun_tokens)
+
+    @cached_property
+    def persons(self):
+        return sort_persons(self.person_counter)
+
+    @cached_property
+    def locations(self):
+        return sort_locations(self.location_counter)
+
+    def topics(self, num_topics=1, num_words=6):
+        return extract_topics_lda(
+            None, num_topics=num_topics, num_words=num_words, tokens=self.noun_tokens
+        )
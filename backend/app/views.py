@@ -1,5 +1,3 @@
-import os
-import uuid
 import json
 import logging
 
@@ -12,7 +10,6 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import get_user_model
 from django.views.decorators.http import require_GET
-import time
 from .models import CauseEffect, MentionedPerson, Task
 
 from rest_framework import generics, status
@@ -36,23 +33,24 @@ from .models import (
     BackgroundImage,
     Table,
     Timeline,
+    ProcessedContent,
 )
+from . import llm_cache, metrics
+from .quota import QuotaExceeded, release_job, reserve_job
 from .serializers import ProjectSerializer, LessonSerializer
+from .storage import store_upload
 from .tasks import process_pdf_task, analyze_lesson_resources
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
-MEDIA_DIR = "/app/media/uploads"  # ✅ Shared directory inside the container
-
-
 @csrf_exempt
 def upload_pdf(request, lesson_id):
     """Handles PDF uploads and ensures the file is saved correctly."""
     if request.method == "POST":
         try:
-            lesson = Lesson.objects.get(pk=lesson_id)
+            lesson = Lesson.objects.select_related("project").get(pk=lesson_id)
         except Lesson.DoesNotExist:
             return JsonResponse({"error": "Lesson not found"}, status=404)
 
@@ -61,40 +59,64 @@ def upload_pdf(request, lesson_id):
                 {"error": "Cannot add resources to an analyzed lesson."}, status=400
             )
 
-        title = request.POST.get("title")
-        file = request.FILES.get("file")
-
-        if not file or not title:
-            return JsonResponse({"error": "Title and file are required"}, status=400)
+        # Checked before the multipart body is parsed: over-quota requests
+        # never spool the upload
+        try:
+            quota_job = reserve_job(lesson.project.created_by_id)
+        except QuotaExceeded as e:
+            return JsonResponse({"error": str(e)}, status=429)
 
-        # Save the file using Django’s FileField
-        lesson_resource = LessonResource.objects.create(
-            lesson=lesson,
-            title=title,
-            file=file,  # Directly assign the uploaded file
-            resource_type=LessonResource.ResourceType.PDF,
-        )
-        lesson_resource.save()  # Ensure it's saved to the database
-        lesson_resource_id = lesson_resource.id
-        logger.info(f"lesson_id: {lesson.id}, lesson_resource_id: {lesson_resource_id}")
-        time.sleep(2)  # Delay for 2 seconds (you can adjust this as needed)
-        os.makedirs(MEDIA_DIR, exist_ok=True)
+        try:
+            title = request.POST.get("title")
+            file = request.FILES.get("file")
 
-        # Save file in the shared media directory
-        unique_filename = f"{uuid.uuid4().hex}_{file.name}"
-        file_path = os.path.join(MEDIA_DIR, unique_filename)
+            if not file or not title:
+                release_job(quota_job)
+                return JsonResponse({"error": "Title and file are required"}, status=400)
 
-        # Save the file
-        with open(file_path, "wb") as f:
-            for chunk in file.chunks():
-                f.write(chunk)
+            with transaction.atomic():
+                lesson_resource = LessonResource(
+                    lesson=lesson,
+                    title=title,
+                    resource_type=LessonResource.ResourceType.PDF,
+                )
+                # Stream the upload to storage once, hashing it on the way
+                content_hash = store_upload(lesson_resource, file)
+
+                # Identical file already processed: reuse its results, queue nothing
+                processed = ProcessedContent.objects.filter(
+                    content_hash=content_hash
+                ).first()
+                if processed:
+                    processed.apply_to(lesson_resource)
+
+                lesson_resource.save()
+                lesson_resource_id = lesson_resource.id
+                logger.info(
+                    f"lesson_id: {lesson.id}, lesson_resource_id: {lesson_resource_id}"
+                )
 
-        process_pdf_task.delay(lesson_id, lesson_resource_id, file_path)
+                if processed:
+                    metrics.incr(metrics.DEDUP_HITS)
+                    release_job(quota_job)  # No AI work to do
+                else:
+                    metrics.incr(metrics.DEDUP_MISSES)
+                    # The worker must see the committed row: dispatch only after COMMIT
+                    transaction.on_commit(
+                        lambda: process_pdf_task.delay(
+                            lesson_id, lesson_resource_id, quota_job=quota_job
+                        )
+                    )
+        except Exception:
+            # Nothing was queued (or the dispatch failed): give the slot back
+            release_job(quota_job)
+            raise
 
         return JsonResponse(
             {
                 "message": "PDF uploaded successfully",
                 "file_url": lesson_resource.file.url,
+                "deduplicated": processed is not None,
             },
             status=201,
         )
@@ -312,20 +334,30 @@ def key_concept_lesson(request, lesson_id):
 @api_view(["POST"])
 def analyze_lesson(request, lesson_id):
     """Trigger AI analysis for a lesson's resources."""
-    lesson = get_object_or_404(Lesson, id=lesson_id)
+    lesson = get_object_or_404(Lesson.objects.select_related("project"), id=lesson_id)
 
-    # Access JSON data from the request body
-    resume_length = request.data.get("resume_length")
-    conceptual_map_size = request.data.get("conceptual_map_size")
-    key_concepts_count = request.data.get("key_concepts_count")
-
-    # Trigger Celery task
-    task = analyze_lesson_resources.delay(
-        lesson.id,
-        resume_length=resume_length,
-        conceptual_map_size=conceptual_map_size,
-        key_concepts_count=key_concepts_count,
-    )
+    try:
+        quota_job = reserve_job(lesson.project.created_by_id)
+    except QuotaExceeded as e:
+        return Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+    try:
+        # Access JSON data from the request body
+        resume_length = request.data.get("resume_length")
+        conceptual_map_size = request.data.get("conceptual_map_size")
+        key_concepts_count = request.data.get("key_concepts_count")
+
+        # Trigger Celery task
+        task = analyze_lesson_resources.delay(
+            lesson.id,
+            resume_length=resume_length,
+            conceptual_map_size=conceptual_map_size,
+            key_concepts_count=key_concepts_count,
+            quota_job=quota_job,
+        )
+    except Exception:
+        release_job(quota_job)  # Nothing was queued
+        raise
 
     return Response(
         {"message": "Analysis started", "task_id": task.id},
@@ -698,3 +730,30 @@ def people_for_lesson(request, lesson_id):
 
         # Return the list of tables
         return Response(people_data)
+
+
+@require_GET
+def metrics_view(request):
+    """Returns the ingest/AI pipeline counters (e.g. deduplication hits and misses)."""
+    counters = metrics.snapshot()
+    return JsonResponse(
+        {
+            "counters": counters,
+            "dedup_hit_rate": _hit_rate(
+                counters[metrics.DEDUP_HITS], counters[metrics.DEDUP_MISSES]
+            ),
+            # Share of the subject classifications that did not call Gemini
+            "classifier_hit_rate": _hit_rate(
+                counters[metrics.CLASSIFIER_HITS], counters[metrics.CLASSIFIER_MISSES]
+            ),
+            "llm_cache_hit_rate": _hit_rate(
+                counters[metrics.LLM_CACHE_HITS], counters[metrics.LLM_CACHE_MISSES]
+            ),
+            "llm_cache_size_bytes": llm_cache.size_bytes(),
+        }
+    )
+
+
+def _hit_rate(hits, misses):
+    lookups = hits + misses
+    return hits / lookups if lookups else None
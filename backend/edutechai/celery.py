@@ -1,5 +1,7 @@
+import gc
 import os
 from celery import Celery
+from celery.signals import worker_init
 
 # Impostiamo la configurazione di Django
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "edutechai.settings")
@@ -11,3 +13,23 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Auto-discover dei task nelle app registrate
 app.autodiscover_tasks()
+
+
+@worker_init.connect
+def load_nlp_models(**kwargs):
+    """
+    Loads spaCy/NLTK and the pretrained topic model once in the worker's main
+    process, before the prefork pool is created: the children inherit the
+    read-only models through copy-on-write instead of loading one copy each.
+    Web processes load them lazily, if ever.
+    """
+    from app.nlp import warm_up
+    from app.topic_model import load_topic_model
+
+    warm_up()
+    load_topic_model()
+
+    # Move everything allocated so far to the permanent generation: the cyclic
+    # GC of the children will not write to (and so copy) the models' pages
+    gc.collect()
+    gc.freeze()
@@ -3,6 +3,7 @@ from pathlib import Path
 from decouple import config
 import os
 import dj_database_url  # Ensure you have this package installed
+from celery.schedules import crontab
 
 """
 Django settings for edutechai project.
@@ -21,7 +22,8 @@ X_FRAME_OPTIONS = "ALLOWALL"  # This allows all domains to embed your content
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 # Load MEDIA_ROOT from .env
-MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# (backend and celery worker must agree on it: the worker reads uploads from here)
+MEDIA_ROOT = config("MEDIA_ROOT", default=os.path.join(BASE_DIR, "media"))
 MEDIA_URL = "/media/"
 GEMINI_API_KEY = config("GEMINI_API_KEY")
 # Quick-start development settings - unsuitable for production
@@ -154,6 +156,78 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_BACKEND = "django-db"  # Salviamo i risultati nel DB di Django
 
+# Job periodici eseguiti da celery beat
+CELERY_BEAT_SCHEDULE = {
+    "retrain-topic-model": {
+        "task": "app.tasks.retrain_topic_model",
+        "schedule": crontab(hour=3, minute=0),  # Every night
+    },
+    "retrain-subject-classifier": {
+        "task": "app.tasks.retrain_subject_classifier",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "flush-api-usage": {
+        "task": "app.tasks.flush_api_usage",
+        "schedule": 60.0,  # Seconds: buffered usage reaches MonthlyAPIUsage within a minute
+    },
+}
+
+# Pretrained NLP models (topic model, ...) shared by the celery workers
+NLP_MODEL_DIR = config("NLP_MODEL_DIR", default=os.path.join(BASE_DIR, "nlp_models"))
+TOPIC_MODEL_NUM_TOPICS = config("TOPIC_MODEL_NUM_TOPICS", default=20, cast=int)
+TOPIC_MODEL_MIN_DOCUMENTS = config("TOPIC_MODEL_MIN_DOCUMENTS", default=20, cast=int)
+
+# Keywords sent to the subject classification prompt: "lda" (topic model) or "tfidf"
+# (document frequencies are only maintained with "tfidf": run
+# `manage.py rebuild_keyword_index` after switching to it)
+KEYWORD_EXTRACTOR = config("KEYWORD_EXTRACTOR", default="lda")
+KEYWORD_IDF_REFRESH_SECONDS = config("KEYWORD_IDF_REFRESH_SECONDS", default=600, cast=int)
+
+# Local subject classifier: below this confidence the subject is asked to Gemini
+SUBJECT_CLASSIFIER_THRESHOLD = config("SUBJECT_CLASSIFIER_THRESHOLD", default=0.9, cast=float)
+SUBJECT_CLASSIFIER_MIN_DOCUMENTS = config(
+    "SUBJECT_CLASSIFIER_MIN_DOCUMENTS", default=50, cast=int
+)
+
+# Lessons longer than this are analysed in parallel chunks (map-reduce), in characters
+ANALYSIS_CHUNK_CHARS = config("ANALYSIS_CHUNK_CHARS", default=60_000, cast=int)
+
+# Cache of the Gemini responses, keyed by model, generation config and prompt
+LLM_CACHE_ENABLED = config("LLM_CACHE_ENABLED", default=True, cast=bool)
+LLM_CACHE_TTL = config("LLM_CACHE_TTL", default=7 * 24 * 3600, cast=int)  # Seconds
+LLM_CACHE_MAX_BYTES = config("LLM_CACHE_MAX_BYTES", default=256 * 1024 * 1024, cast=int)
+LLM_CACHE_MAX_ENTRY_BYTES = config("LLM_CACHE_MAX_ENTRY_BYTES", default=1024 * 1024, cast=int)
+
+# Cluster-wide Gemini quota, per model ("default" applies to every model)
+GEMINI_RATE_LIMITS = {
+    "default": {
+        "rpm": config("GEMINI_REQUESTS_PER_MINUTE", default=30, cast=int),
+        "tpm": config("GEMINI_TOKENS_PER_MINUTE", default=1_000_000, cast=int),
+        "max_concurrency": config("GEMINI_MAX_CONCURRENCY", default=16, cast=int),
+    },
+}
+GEMINI_MIN_CONCURRENCY = 1
+GEMINI_OUTPUT_TOKENS_ESTIMATE = 1024  # Reserved per call until the real usage is known
+GEMINI_RATE_LIMIT_MAX_WAIT = config("GEMINI_RATE_LIMIT_MAX_WAIT", default=120, cast=int)  # Seconds
+GEMINI_LEASE_TIMEOUT = 300  # Seconds before the slot of a crashed call is reclaimed
+GEMINI_THROTTLE_COOLDOWN = 5  # Seconds between two halvings of the concurrency
+GEMINI_THROTTLE_ATTEMPTS = 3  # Attempts of a call that gets quota errors
+
+# Per-user quotas checked before dispatching AI work, by subscription type
+# ("NONE": no active subscription). None means unlimited.
+# Off by default: projects are still all created by the same user (pk=1), so
+# every job would count against a single quota until real owners are set.
+QUOTA_ENABLED = config("QUOTA_ENABLED", default=False, cast=bool)
+QUOTA_PLANS = {
+    "NONE": {"monthly_tokens": config("QUOTA_FREE_MONTHLY_TOKENS", default=100_000, cast=int), "max_jobs": 1},
+    "TRIAL": {"monthly_tokens": config("QUOTA_TRIAL_MONTHLY_TOKENS", default=500_000, cast=int), "max_jobs": 2},
+    "MONTHLY": {"monthly_tokens": config("QUOTA_MONTHLY_TOKENS", default=5_000_000, cast=int), "max_jobs": 5},
+    "YEARLY": {"monthly_tokens": config("QUOTA_YEARLY_TOKENS", default=5_000_000, cast=int), "max_jobs": 5},
+}
+QUOTA_PLAN_CACHE_SECONDS = 3600  # Entitlements in the shared cache (dropped when they change)
+QUOTA_LOCAL_CACHE_SECONDS = 30  # Entitlements and rejections cached in each process
+QUOTA_JOB_TIMEOUT = 1800  # Seconds before the slot of a job that never finished is reclaimed
+
 # Configurazione Redis per la cache (opzionale)
 CACHES = {
     "default": {
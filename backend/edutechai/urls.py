@@ -80,6 +80,7 @@ urlpatterns = [
     path('api/lessons/<int:lesson_id>/timelines/', views.timeline_for_lesson, name='lesson-timelines'),  # Modify or delete a specific task for the logged-in user # type: ignore
     path('api/lessons/<int:lesson_id>/causeeffects/', views.cause_effect_for_lesson, name='lesson-cause-effects'),  # Modify or delete a specific task for the logged-in user # type: ignore
     path('api/lessons/<int:lesson_id>/people/', views.people_for_lesson, name='lesson-people'),  # Modify or delete a specific task for the logged-in user # type: ignore
+    path("api/metrics/", views.metrics_view, name="metrics"),
 
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)